@@ -0,0 +1,22 @@
+"""Index devices on (name, id) for keyset pagination
+
+Revision ID: 0004_devices_name_id_index
+Revises: 0003_drop_borrower_display
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0004_devices_name_id_index"
+down_revision = "0003_drop_borrower_display"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_devices_name_id", "devices", ["name", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_devices_name_id", table_name="devices")
@@ -0,0 +1,46 @@
+"""Full-text and trigram search on devices
+
+Revision ID: 0005_devices_search
+Revises: 0004_devices_name_id_index
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0005_devices_search"
+down_revision = "0004_devices_name_id_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # Stored generated column: existing rows are backfilled when it is added
+    op.execute(
+        "ALTER TABLE devices ADD COLUMN search_document tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple', "
+        "coalesce(name, '') || ' ' || coalesce(inventory_number, '') || ' ' "
+        "|| coalesce(description, ''))) STORED"
+    )
+    op.execute(
+        "CREATE INDEX ix_devices_search_document ON devices USING gin (search_document)"
+    )
+    op.execute(
+        "CREATE INDEX ix_devices_inventory_number_trgm "
+        "ON devices USING gin (inventory_number gin_trgm_ops)"
+    )
+    op.execute(
+        "CREATE INDEX ix_devices_name_trgm ON devices USING gin (name gin_trgm_ops)"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.drop_index("ix_devices_name_trgm", table_name="devices")
+    op.drop_index("ix_devices_inventory_number_trgm", table_name="devices")
+    op.drop_index("ix_devices_search_document", table_name="devices")
+    op.drop_column("devices", "search_document")
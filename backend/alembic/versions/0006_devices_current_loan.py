@@ -0,0 +1,52 @@
+"""Add devices.current_loan_id
+
+Revision ID: 0006_devices_current_loan
+Revises: 0005_devices_search
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0006_devices_current_loan"
+down_revision = "0005_devices_search"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("devices", sa.Column("current_loan_id", sa.Integer(), nullable=True))
+    op.create_foreign_key(
+        "fk_devices_current_loan_id",
+        "devices",
+        "loans",
+        ["current_loan_id"],
+        ["id"],
+    )
+
+    devices = sa.table(
+        "devices",
+        sa.column("id", sa.Integer),
+        sa.column("current_loan_id", sa.Integer),
+    )
+    loans = sa.table(
+        "loans",
+        sa.column("id", sa.Integer),
+        sa.column("device_id", sa.Integer),
+        sa.column("loaned_at", sa.DateTime),
+        sa.column("returned_at", sa.DateTime),
+    )
+    latest_open = (
+        sa.select(loans.c.id)
+        .where(loans.c.device_id == devices.c.id, loans.c.returned_at.is_(None))
+        .order_by(loans.c.loaned_at.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    op.get_bind().execute(sa.update(devices).values(current_loan_id=latest_open))
+
+
+def downgrade():
+    op.drop_constraint("fk_devices_current_loan_id", "devices", type_="foreignkey")
+    op.drop_column("devices", "current_loan_id")
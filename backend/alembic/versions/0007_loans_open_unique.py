@@ -0,0 +1,41 @@
+"""One open loan per device (partial unique index)
+
+Revision ID: 0007_loans_open_unique
+Revises: 0006_devices_current_loan
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0007_loans_open_unique"
+down_revision = "0006_devices_current_loan"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Close older duplicates left by past races so that the index can be built;
+    # the most recent open loan (the one devices.current_loan_id points to) is kept.
+    op.execute("""
+        UPDATE loans SET returned_at = CURRENT_TIMESTAMP
+        WHERE returned_at IS NULL
+          AND id NOT IN (SELECT current_loan_id FROM devices WHERE current_loan_id IS NOT NULL)
+          AND device_id IN (
+            SELECT device_id FROM loans WHERE returned_at IS NULL
+            GROUP BY device_id HAVING COUNT(*) > 1
+          )
+        """)
+    op.create_index(
+        "uq_loans_open_device",
+        "loans",
+        ["device_id"],
+        unique=True,
+        postgresql_where=sa.text("returned_at IS NULL"),
+        sqlite_where=sa.text("returned_at IS NULL"),
+    )
+
+
+def downgrade():
+    op.drop_index("uq_loans_open_device", table_name="loans")
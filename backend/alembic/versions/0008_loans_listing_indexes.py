@@ -0,0 +1,39 @@
+"""Indexes for the paginated loan listing
+
+Revision ID: 0008_loans_listing_indexes
+Revises: 0007_loans_open_unique
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0008_loans_listing_indexes"
+down_revision = "0007_loans_open_unique"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_loans_loaned_at_id", "loans", ["loaned_at", "id"])
+    op.create_index(
+        "ix_loans_borrower_loaned_at", "loans", ["borrower_id", "loaned_at", "id"]
+    )
+    op.create_index(
+        "ix_loans_device_loaned_at", "loans", ["device_id", "loaned_at", "id"]
+    )
+    op.create_index(
+        "ix_loans_open_due_date",
+        "loans",
+        ["due_date"],
+        postgresql_where=sa.text("returned_at IS NULL"),
+        sqlite_where=sa.text("returned_at IS NULL"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_loans_open_due_date", table_name="loans")
+    op.drop_index("ix_loans_device_loaned_at", table_name="loans")
+    op.drop_index("ix_loans_borrower_loaned_at", table_name="loans")
+    op.drop_index("ix_loans_loaned_at_id", table_name="loans")
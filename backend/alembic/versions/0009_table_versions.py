@@ -0,0 +1,27 @@
+"""Per-table write counters for cache invalidation
+
+Revision ID: 0009_table_versions
+Revises: 0008_loans_listing_indexes
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0009_table_versions"
+down_revision = "0008_loans_listing_indexes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "table_versions",
+        sa.Column("table_name", sa.String(length=100), primary_key=True),
+        sa.Column("version", sa.Integer(), nullable=False, server_default="0"),
+    )
+
+
+def downgrade():
+    op.drop_table("table_versions")
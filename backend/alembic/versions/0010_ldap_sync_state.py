@@ -0,0 +1,30 @@
+"""Checkpoint table of the LDAP directory sync
+
+Revision ID: 0010_ldap_sync_state
+Revises: 0009_table_versions
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0010_ldap_sync_state"
+down_revision = "0009_table_versions"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "ldap_sync_state",
+        sa.Column("name", sa.String(length=50), primary_key=True),
+        sa.Column("pages_done", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("users_done", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table("ldap_sync_state")
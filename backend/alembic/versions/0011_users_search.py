@@ -0,0 +1,38 @@
+"""Prefix and trigram indexes for the borrower search
+
+Revision ID: 0011_users_search
+Revises: 0010_ldap_sync_state
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0011_users_search"
+down_revision = "0010_ldap_sync_state"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute(
+        "CREATE INDEX ix_users_username_prefix ON users (lower(username) text_pattern_ops)"
+    )
+    op.execute(
+        "CREATE INDEX ix_users_username_trgm ON users USING gin (username gin_trgm_ops)"
+    )
+    op.execute(
+        "CREATE INDEX ix_users_full_name_trgm ON users USING gin "
+        "((coalesce(first_name, '') || ' ' || coalesce(last_name, '')) gin_trgm_ops)"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.drop_index("ix_users_full_name_trgm", table_name="users")
+    op.drop_index("ix_users_username_trgm", table_name="users")
+    op.drop_index("ix_users_username_prefix", table_name="users")
@@ -0,0 +1,22 @@
+"""Index on devices.type_id for the type-name search
+
+Revision ID: 0012_devices_type_id_index
+Revises: 0011_users_search
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0012_devices_type_id_index"
+down_revision = "0011_users_search"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_devices_type_id", "devices", ["type_id"])
+
+
+def downgrade():
+    op.drop_index("ix_devices_type_id", table_name="devices")
@@ -0,0 +1,25 @@
+"""Resume key of the LDAP directory sync
+
+Revision ID: 0013_ldap_sync_last_shard
+Revises: 0012_devices_type_id_index
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0013_ldap_sync_last_shard"
+down_revision = "0012_devices_type_id_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "ldap_sync_state", sa.Column("last_shard", sa.String(length=16), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_column("ldap_sync_state", "last_shard")
@@ -0,0 +1,26 @@
+"""Per-row version of devices (ETag of the device detail)
+
+Revision ID: 0014_devices_version
+Revises: 0013_ldap_sync_last_shard
+Create Date: 2026-10-17
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0014_devices_version"
+down_revision = "0013_ldap_sync_last_shard"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "devices",
+        sa.Column("version", sa.Integer(), nullable=False, server_default="1"),
+    )
+
+
+def downgrade():
+    op.drop_column("devices", "version")
@@ -1,17 +1,18 @@
 from datetime import datetime, timedelta
 from typing import Optional
+import hashlib
 import logging
-from ldap3.utils.uri import parse_uri
-from sqlalchemy import func, select
+import time
 
+import jwt as pyjwt
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-import ssl
-from ldap3 import Connection, Server, ALL, Tls
+from ldap3.core.exceptions import LDAPCommunicationError, LDAPException
 
 from .config import get_settings, Settings
-from . import crud
+from . import cache, crud, ldap_client, metrics
 from .database import SessionLocal
 
 # Use uvicorn logger so messages show up in container logs without extra config
@@ -20,105 +21,87 @@ logger = logging.getLogger("uvicorn.error")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token", auto_error=False)
 
 
-def ldap_auth_and_profile(username: str, password: str, settings: Settings) -> dict:
-    """
-    Recherche l'utilisateur via le compte de service (si fourni), bind avec son mot de passe,
-    et retourne les attributs utiles.
-    """
-    # Force TLS 1.2 and a commonly accepted cipher for AD/LDAPS endpoints that reset on defaults
-    tls_config = Tls(
-        validate=ssl.CERT_NONE,
-        version=ssl.PROTOCOL_TLSv1_2,
-        ciphers="ECDHE-RSA-AES256-GCM-SHA384",
+def _invalid_credentials() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid LDAP credentials"
     )
-    search_filter = settings.ldap_search_filter.format(username=username)
-    uri = parse_uri(settings.ldap_server)
-    use_ssl = uri["ssl"]
-    server = Server(settings.ldap_server, get_info=ALL, use_ssl=use_ssl, tls=tls_config)
 
-    # Si compte de service, on l'utilise pour trouver le DN de l'utilisateur
-    user_dn = settings.ldap_user_dn_template.format(username=username)
-    try:
-        if settings.ldap_bind_dn and settings.ldap_bind_password:
-            with Connection(
-                server,
-                user=settings.ldap_bind_dn,
-                password=settings.ldap_bind_password,
-                auto_bind=True,
-            ) as conn:
+
+def _service_search(
+    pool: ldap_client.ServiceConnectionPool, settings: Settings, search_filter: str
+):
+    # One retry: a pooled connection may have been dropped by the server while idle
+    for attempt in range(2):
+        try:
+            with pool.connection() as conn:
                 found = conn.search(
                     search_base=settings.ldap_search_base,
                     search_filter=search_filter,
-                    attributes=[
-                        "cn",
-                        "uid",
-                        "sAMAccountName",
-                        "distinguishedName",
-                        "mail",
-                        "givenName",
-                        "sn",
-                    ],
+                    attributes=ldap_client.PROFILE_ATTRIBUTES,
                 )
                 if not found or not conn.entries:
-                    raise HTTPException(
-                        status_code=status.HTTP_401_UNAUTHORIZED,
-                        detail="Invalid LDAP credentials",
-                    )
-                user_dn = str(conn.entries[0].entry_dn)
+                    return None
+                entry = conn.entries[0]
+                return str(entry.entry_dn), entry.entry_attributes_as_dict
+        except LDAPException:
+            if attempt:
+                raise
+
+
+def ldap_auth_and_profile(username: str, password: str, settings: Settings) -> dict:
+    """
+    Recherche l'utilisateur via le compte de service (si fourni), bind avec son mot de passe,
+    et retourne les attributs utiles.
+    """
+    search_filter = settings.ldap_search_filter.format(username=username)
+    server = ldap_client.get_server(settings)
+    pool = ldap_client.get_service_pool(settings)
+    try:
+        if pool is not None:
+            # Le compte de service trouve le DN et le profil ; le bind utilisateur
+            # ne sert plus qu'à vérifier le mot de passe.
+            result = _service_search(pool, settings, search_filter)
+            if result is None:
+                raise _invalid_credentials()
+            user_dn, attrs = result
+            conn_user = ldap_client.new_connection(
+                server, user_dn, password, settings.ldap_receive_timeout
+            )
+            try:
+                if not conn_user.bind():
+                    raise _invalid_credentials()
+            finally:
+                conn_user.unbind()
+            return ldap_client.profile_from_attrs(attrs, username)
 
-        # Bind avec les credentials utilisateur
-        with Connection(
-            server, user=user_dn, password=password, auto_bind=True
+        # Sans compte de service : bind avec les credentials utilisateur puis recherche
+        user_dn = settings.ldap_user_dn_template.format(username=username)
+        with ldap_client.new_connection(
+            server,
+            user_dn,
+            password,
+            settings.ldap_receive_timeout,
+            auto_bind=True,
         ) as conn_user:
             found = conn_user.search(
                 search_base=settings.ldap_search_base,
                 search_filter=search_filter,
-                attributes=[
-                    "displayName",
-                    "givenName",
-                    "sn",
-                    "cn",
-                    "mail",
-                    "sAMAccountName",
-                ],
+                attributes=ldap_client.PROFILE_ATTRIBUTES,
             )
             if not found or not conn_user.entries:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Invalid LDAP credentials",
-                )
-            attrs = conn_user.entries[0].entry_attributes_as_dict
-            first_name = attrs.get("givenName")
-            if isinstance(first_name, list):
-                first_name = first_name[0] if first_name else None
-            last_name = attrs.get("sn")
-            if isinstance(last_name, list):
-                last_name = last_name[0] if last_name else None
-            email = attrs.get("mail")
-            if isinstance(email, list):
-                email = email[0] if email else None
-            username_out = attrs.get("sAMAccountName")
-            if isinstance(username_out, list):
-                username_out = username_out[0] if username_out else None
-            username_out = username_out or username
-            display_name_attr = attrs.get("displayName")
-            if isinstance(display_name_attr, list):
-                display_name_attr = display_name_attr[0] if display_name_attr else None
-            display_name = display_name_attr or " ".join(filter(None, [first_name, last_name])) or username_out
-            return {
-                "username": username_out,
-                "email": email,
-                "first_name": first_name,
-                "last_name": last_name,
-                "display_name": display_name,
-            }
-    except HTTPException:
+                raise _invalid_credentials()
+            return ldap_client.profile_from_attrs(
+                conn_user.entries[0].entry_attributes_as_dict, username
+            )
+    except (HTTPException, ldap_client.LdapBusyError):
         raise
+    except (LDAPCommunicationError, TimeoutError) as exc:
+        # Directory unreachable: not the user's fault, feeds the circuit breaker
+        logger.warning("LDAP unavailable: %s", exc)
+        raise ldap_client.LdapUnavailableError(str(exc))
     except Exception as exc:
         logger.warning("LDAP auth/profile error: %s", exc)
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid LDAP credentials"
-        )
+        raise _invalid_credentials()
 
 
 def create_access_token(data: dict, settings: Settings) -> str:
@@ -131,12 +114,62 @@ def create_access_token(data: dict, settings: Settings) -> str:
     return encoded_jwt
 
 
-def _get_user_from_db(username: str):
+def _decode_with_backend(token: str, settings: Settings) -> dict:
+    if settings.jwt_backend == "pyjwt":
+        try:
+            return pyjwt.decode(
+                token, settings.jwt_secret_key, algorithms=[settings.jwt_algorithm]
+            )
+        except pyjwt.PyJWTError as exc:
+            raise JWTError(str(exc))
+    return jwt.decode(
+        token, settings.jwt_secret_key, algorithms=[settings.jwt_algorithm]
+    )
+
+
+def decode_access_token(token: str, settings: Settings) -> dict:
+    """
+    Verify a bearer token, reusing the claims of tokens already verified.
+    Entries are keyed by the token digest and expire with the token (exp).
+    """
+    digest = hashlib.sha256(token.encode("utf-8")).digest()
+    claims = cache.tokens.get(digest)
+    if claims is not None:
+        return claims
+    claims = _decode_with_backend(token, settings)
+    exp = claims.get("exp")
+    if isinstance(exp, (int, float)):
+        ttl = exp - time.time()
+        if ttl > 0:
+            cache.tokens.set(digest, claims, ttl=ttl)
+    return claims
+
+
+_NOT_CACHED = object()
+
+
+def _resolve_principal(username: str) -> Optional[dict]:
+    """Roles/profile of a user from the users table, cached per username."""
+    principal = cache.principals.get(username, _NOT_CACHED)
+    if principal is not _NOT_CACHED:
+        return principal
     try:
         with SessionLocal() as db:
-            return crud.get_user(db, username)
+            db_user = crud.get_user(db, username)
+            principal = None
+            if db_user:
+                principal = {
+                    "roles": [r.name for r in db_user.roles],
+                    "display_name": db_user.display_name,
+                    "email": db_user.email,
+                    "first_name": db_user.first_name,
+                    "last_name": db_user.last_name,
+                }
     except Exception:
+        # Do not cache lookup failures
         return None
+    cache.principals.set(username, principal)
+    return principal
 
 
 def get_current_user(
@@ -176,9 +209,7 @@ def get_current_user(
         # No token provided -> reject
         raise credentials_exception
     try:
-        payload = jwt.decode(
-            token, settings.jwt_secret_key, algorithms=[settings.jwt_algorithm]
-        )
+        payload = decode_access_token(token, settings)
         username_raw = payload.get("sub")
         username: Optional[str] = username_raw[0] if isinstance(username_raw, list) else username_raw
         if username is None:
@@ -186,24 +217,28 @@ def get_current_user(
     except JWTError:
         raise credentials_exception
     roles = payload.get("roles", []) or []
-    db_user = _get_user_from_db(username)
-    display_name = db_user.display_name if db_user else None
-    email = db_user.email if db_user else None
-    first_name = db_user.first_name if db_user else None
-    last_name = db_user.last_name if db_user else None
-    if db_user:
-        roles = [r.name for r in db_user.roles] or roles
+    if settings.trust_token_roles:
+        # Roles/profile are frozen in the token until it expires
+        return {
+            "username": username,
+            "roles": roles,
+            "display_name": payload.get("name"),
+            "email": payload.get("email"),
+            "first_name": payload.get("given_name"),
+            "last_name": payload.get("family_name"),
+        }
+    principal = _resolve_principal(username) or {}
     return {
         "username": username,
-        "roles": roles,
-        "display_name": display_name,
-        "email": email,
-        "first_name": first_name,
-        "last_name": last_name,
+        "roles": principal.get("roles") or roles,
+        "display_name": principal.get("display_name"),
+        "email": principal.get("email"),
+        "first_name": principal.get("first_name"),
+        "last_name": principal.get("last_name"),
     }
 
 
-def login(
+async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
     settings: Settings = Depends(get_settings),
 ):
@@ -214,50 +249,76 @@ def login(
         )
         return {"access_token": access_token, "token_type": "bearer"}
 
-    profile = ldap_auth_and_profile(
-        form_data.username, form_data.password, settings=settings
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        profile = await ldap_client.get_runner().run(
+            ldap_auth_and_profile,
+            form_data.username,
+            form_data.password,
+            settings=settings,
+        )
+        outcome = "success"
+    except ldap_client.LdapUnavailableError:
+        outcome = "unavailable"
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service unavailable, retry later",
+            headers={"Retry-After": str(settings.ldap_breaker_reset_seconds)},
+        )
+    except ldap_client.LdapBusyError:
+        outcome = "busy"
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service busy, retry later",
+            headers={"Retry-After": "1"},
+        )
+    except HTTPException:
+        outcome = "rejected"
+        raise
+    finally:
+        metrics.observe_ldap_login(outcome, time.perf_counter() - started)
+    # DB part stays on the regular threadpool
+    return await run_in_threadpool(
+        _token_for_profile, profile, form_data.username, settings
     )
-    user_username = profile.get("username") or form_data.username
+
+
+def _token_for_profile(profile: dict, login_username: str, settings: Settings) -> dict:
+    user_username = profile.get("username") or login_username
     email = profile.get("email")
     first_name = profile.get("first_name")
     last_name = profile.get("last_name")
 
-    db_user = _get_user_from_db(user_username)
-    roles = [r.name for r in db_user.roles] if db_user else None
-    if roles is None or not roles:
-        if not settings.auto_provision_users:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="User not provisioned. Contact an administrator.",
+    # Lookup, auto-provisioning and profile refresh in one session/transaction
+    try:
+        with SessionLocal() as db:
+            roles = crud.provision_login_user(
+                db,
+                username=user_username,
+                email=email,
+                first_name=first_name,
+                last_name=last_name,
+                auto_provision=settings.auto_provision_users,
             )
-        # Auto-provision user. If first user ever, make admin; otherwise employee.
-        try:
-            with SessionLocal() as db:
-                crud.ensure_roles_exist(db)
-                has_any_user = db.scalar(select(func.count()).select_from(crud.models.User)) > 0  # type: ignore[attr-defined]
-                default_roles = ["admin"] if not has_any_user else ["employee"]
-                user = crud.upsert_user_with_roles(
-                    db,
-                    username=user_username,
-                    roles=default_roles,
-                    email=email,
-                    first_name=first_name,
-                    last_name=last_name,
-                )
-                roles = [r.name for r in user.roles]
-                db_user = user
-        except Exception:
-            roles = ["employee"]
-    else:
-        # Mettre à jour les infos si manquantes
-        if db_user:
-            with SessionLocal() as db:
-                crud.update_user_profile(
-                    db,
-                    username=user_username,
-                    email=email,
-                    first_name=first_name,
-                    last_name=last_name,
-                )
-    access_token = create_access_token({"sub": user_username, "roles": roles}, settings)
+    except Exception as exc:
+        logger.warning("User provisioning failed for %s: %s", user_username, exc)
+        roles = ["employee"]
+    if roles is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="User not provisioned. Contact an administrator.",
+        )
+    access_token = create_access_token(
+        {
+            "sub": user_username,
+            "roles": roles,
+            # Profile claims, used when trust_token_roles is enabled
+            "name": profile.get("display_name"),
+            "email": email,
+            "given_name": first_name,
+            "family_name": last_name,
+        },
+        settings,
+    )
     return {"access_token": access_token, "token_type": "bearer"}
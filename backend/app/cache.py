@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, NamedTuple, Optional
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import get_settings
+
+
+class LookupRow(NamedTuple):
+    id: int
+    name: str
+
+
+def get_table_version(db: Session, table_name: str) -> int:
+    version = db.scalar(
+        select(models.TableVersion.version).where(
+            models.TableVersion.table_name == table_name
+        )
+    )
+    return version or 0
+
+
+def get_table_versions(db: Session, table_names) -> Dict[str, int]:
+    """Versions of several tables in one query (0 for tables never bumped)."""
+    rows = db.execute(
+        select(models.TableVersion.table_name, models.TableVersion.version).where(
+            models.TableVersion.table_name.in_(table_names)
+        )
+    )
+    versions = dict(rows.all())
+    return {name: versions.get(name, 0) for name in table_names}
+
+
+def bump_table_version(db: Session, table_name: str) -> None:
+    """Increment the version of a table; call inside the write transaction."""
+    # Single upsert: two first writers cannot both miss the row and both insert it
+    dialect = sqlite if db.get_bind().dialect.name == "sqlite" else postgresql
+    stmt = dialect.insert(models.TableVersion).values(table_name=table_name, version=1)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[models.TableVersion.table_name],
+            set_={"version": models.TableVersion.version + 1},
+        )
+    )
+
+
+class LookupCache:
+    """
+    Process-wide id/name map of a small lookup table.
+    Other workers' writes are picked up through table_versions, checked at most
+    every lookup_cache_check_seconds.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.table_name = model.__tablename__
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+        self._by_name: Dict[str, LookupRow] = {}
+        self._by_id: Dict[int, LookupRow] = {}
+
+    def _load(self, db: Session, version: int) -> None:
+        rows = [
+            LookupRow(id=row.id, name=row.name)
+            for row in db.execute(select(self.model.id, self.model.name))
+        ]
+        with self._lock:
+            self._by_name = {row.name: row for row in rows}
+            self._by_id = {row.id: row for row in rows}
+            self._version = version
+            self._checked_at = time.monotonic()
+
+    def _refresh(self, db: Session) -> None:
+        ttl = get_settings().lookup_cache_check_seconds
+        if self._version is not None and time.monotonic() - self._checked_at < ttl:
+            return
+        version = get_table_version(db, self.table_name)
+        if version == self._version:
+            self._checked_at = time.monotonic()
+            return
+        self._load(db, version)
+
+    def all(self, db: Session) -> Dict[str, LookupRow]:
+        self._refresh(db)
+        return self._by_name
+
+    def get(self, db: Session, name: str) -> Optional[LookupRow]:
+        self._refresh(db)
+        row = self._by_name.get(name)
+        if row is None:
+            # Rows seeded outside the app (init_db) do not bump the version
+            self._load(db, get_table_version(db, self.table_name))
+            row = self._by_name.get(name)
+        return row
+
+    def get_by_id(self, db: Session, row_id: int) -> Optional[LookupRow]:
+        self._refresh(db)
+        row = self._by_id.get(row_id)
+        if row is None:
+            self._load(db, get_table_version(db, self.table_name))
+            row = self._by_id.get(row_id)
+        return row
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._version = None
+
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries expire after ttl seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            # Expired entries nobody asks for again leave from the LRU end
+            now = time.monotonic()
+            while self._data:
+                oldest_key, (oldest_expiry, _) = next(iter(self._data.items()))
+                if oldest_expiry > now:
+                    break
+                del self._data[oldest_key]
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+statuses = LookupCache(models.DeviceStatus)
+device_types = LookupCache(models.DeviceType)
+roles = LookupCache(models.Role)
+
+_settings = get_settings()
+# Resolved principals (roles/profile from the users table) keyed by username
+principals = TTLCache(
+    maxsize=_settings.principal_cache_size, ttl=_settings.principal_cache_ttl_seconds
+)
+# Device list totals (total_mode=cached) keyed by filter set, cleared on device writes
+device_totals = TTLCache(
+    maxsize=_settings.devices_total_cache_size,
+    ttl=_settings.devices_total_cache_ttl_seconds,
+)
+# Claims of already verified JWTs keyed by token digest, each kept until its exp
+tokens = TTLCache(maxsize=_settings.token_cache_size, ttl=0)
@@ -1,6 +1,34 @@
 from functools import lru_cache
-from typing import List, Union
-from pydantic import BaseSettings, Field, validator
+from typing import List, Optional, Union
+from pydantic import BaseSettings, Field, root_validator, validator
+
+# Engine pool defaults per environment, used for every DB_* setting left unset
+DB_POOL_DEFAULTS = {
+    "dev": {
+        "db_pool_size": 5,
+        "db_max_overflow": 5,
+        "db_pool_timeout": 30.0,
+        "db_pool_recycle_seconds": 1800,
+        "db_pool_pre_ping": True,
+        "db_statement_timeout_ms": 0,
+    },
+    "staging": {
+        "db_pool_size": 5,
+        "db_max_overflow": 10,
+        "db_pool_timeout": 10.0,
+        "db_pool_recycle_seconds": 1800,
+        "db_pool_pre_ping": True,
+        "db_statement_timeout_ms": 30000,
+    },
+    "prod": {
+        "db_pool_size": 10,
+        "db_max_overflow": 20,
+        "db_pool_timeout": 10.0,
+        "db_pool_recycle_seconds": 1800,
+        "db_pool_pre_ping": True,
+        "db_statement_timeout_ms": 30000,
+    },
+}
 
 
 class Settings(BaseSettings):
@@ -9,10 +37,51 @@ class Settings(BaseSettings):
     environment: str = Field(default="dev", regex="^(dev|prod|staging)$")
 
     database_url: str = "postgresql+psycopg2://postgres:postgres@db:5432/inventory"
+    # Engine pool (Postgres only); unset values come from DB_POOL_DEFAULTS
+    db_pool_size: Optional[int] = None
+    db_max_overflow: Optional[int] = None
+    db_pool_timeout: Optional[float] = None
+    db_pool_recycle_seconds: Optional[int] = None
+    db_pool_pre_ping: Optional[bool] = None
+    # Server-side statement_timeout, 0 disables it
+    db_statement_timeout_ms: Optional[int] = None
+    db_application_name: str = "inventory-api"
+    # Optional read replica for the read-only routes; unset = everything on the primary
+    database_read_url: Optional[str] = None
+    # After a write, the same client reads from the primary for this long
+    read_after_write_seconds: int = 5
+    # Per-request DB instrumentation (Server-Timing header); 0 disables a threshold
+    db_instrumentation: bool = True
+    slow_request_log_ms: int = 1000
+    slow_request_log_queries: int = 50
+    # Log statements repeated this many times in one request (suspected N+1)
+    n_plus_one_log_threshold: int = 0
+    # Response compression: brotli or gzip as accepted; smaller bodies are sent as is
+    compression_enabled: bool = True
+    compression_minimum_size: int = 1024
+    gzip_level: int = Field(default=6, ge=1, le=9)
+    brotli_quality: int = Field(default=4, ge=0, le=11)
+    # Prometheus /metrics (needs prometheus-client; PROMETHEUS_MULTIPROC_DIR for workers)
+    metrics_enabled: bool = True
+    # When set, /metrics requires "Authorization: Bearer <token>" (Prometheus
+    # authorization.credentials); otherwise keep /metrics off the public proxy
+    metrics_token: str = ""
+    # /devices, /loans and /catalog on AsyncSession/asyncpg instead of the threadpool
+    db_async: bool = False
+    # Defaults to DATABASE_URL with the asyncpg driver
+    database_async_url: Optional[str] = None
+    # Lifetime and count of cached device totals (total_mode=cached), one per filter set
+    devices_total_cache_ttl_seconds: int = 30
+    devices_total_cache_size: int = 1024
+    # How often cached lookup tables (statuses, types, roles) check for writes
+    lookup_cache_check_seconds: int = 5
 
     jwt_secret_key: str = Field(default="changeme", env="JWT_SECRET_KEY")
     jwt_algorithm: str = "HS256"
     jwt_expiration_minutes: int = 60 * 12
+    # JWT decoder: "jose" (python-jose) or "pyjwt" (PyJWT)
+    jwt_backend: str = Field(default="jose", regex="^(jose|pyjwt)$")
+    token_cache_size: int = 2048
 
     ldap_server: str = Field(default="ldap://localhost:389", env="LDAP_SERVER")
     ldap_user_dn_template: str = Field(
@@ -22,8 +91,29 @@ class Settings(BaseSettings):
     ldap_search_filter: str = Field(default="(uid={username})")
     ldap_bind_dn: str | None = Field(default=None, env="LDAP_BIND_DN")
     ldap_bind_password: str | None = Field(default=None, env="LDAP_BIND_PASSWORD")
+    # Pooled service-account connections used for the DN/profile search at login
+    ldap_pool_size: int = 4
+    ldap_pool_wait_timeout: float = 5.0
+    ldap_connect_timeout: int = 5
+    ldap_receive_timeout: int = 10
+    # Dedicated LDAP executor: concurrency, waiting logins, per-login timeout.
+    # With a service account, concurrency must not exceed LDAP_POOL_SIZE.
+    ldap_max_concurrency: int = 4
+    ldap_max_queue: int = 100
+    ldap_operation_timeout: float = 15.0
+    # Circuit breaker: consecutive failures before failing fast, and for how long
+    ldap_breaker_failure_threshold: int = 5
+    ldap_breaker_reset_seconds: int = 30
+    # Directory sync (sync_ldap_users.py); interval 0 disables the background task
+    ldap_sync_page_size: int = 500
+    ldap_sync_interval_minutes: int = 0
 
     auto_provision_users: bool = Field(default=True, env="AUTO_PROVISION_USERS")
+    # Principal cache of get_current_user; other workers see role changes after the TTL
+    principal_cache_size: int = 1024
+    principal_cache_ttl_seconds: int = 60
+    # Use the roles/profile carried by the JWT without reading the users table
+    trust_token_roles: bool = False
 
     auth_disabled: bool = False
     dev_user: str = "dev-user"  # fallback name if lookup by ID fails
@@ -37,6 +127,23 @@ class Settings(BaseSettings):
             return [part.strip() for part in v.split(",") if part.strip()]
         return v
 
+    @root_validator(skip_on_failure=True)
+    def apply_db_pool_defaults(cls, values):
+        defaults = DB_POOL_DEFAULTS[values["environment"]]
+        for name, default in defaults.items():
+            if values.get(name) is None:
+                values[name] = default
+        return values
+
+    @root_validator(skip_on_failure=True)
+    def check_ldap_concurrency(cls, values):
+        # More LDAP workers than pooled connections only wait on the pool
+        if values["ldap_bind_dn"] and (
+            values["ldap_max_concurrency"] > values["ldap_pool_size"]
+        ):
+            raise ValueError("LDAP_MAX_CONCURRENCY must not exceed LDAP_POOL_SIZE")
+        return values
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -1,9 +1,16 @@
+import base64
+import binascii
+import json
 from datetime import datetime
-from typing import List, Optional, Tuple
-from sqlalchemy import select, or_, func
-from sqlalchemy.orm import Session, selectinload, load_only
+from typing import Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import and_, exists, or_, select, func, text, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased, selectinload, load_only
 
-from . import models, schemas
+from . import cache, metrics, models, schemas
+from .config import get_settings
+from .search import device_search_clause, user_search_clause
 
 ALLOWED_ROLES = {r.value for r in schemas.RoleName}
 SECURITY_RULES = {
@@ -15,8 +22,25 @@ SECURITY_RULES = {
 }
 
 
+class LoanConflictError(ValueError):
+    """Loan/return refused because the device state changed concurrently."""
+
+
+# Everything DeviceRead reads: the routes serialize outside the session's thread
+_DEVICE_READ_OPTIONS = [
+    selectinload(models.Device.type),
+    selectinload(models.Device.status),
+    selectinload(models.Device.current_loan).selectinload(models.Loan.borrower),
+]
+
+
 def get_device(db: Session, device_id: int) -> Optional[models.Device]:
-    return db.get(models.Device, device_id)
+    return db.get(
+        models.Device,
+        device_id,
+        options=_DEVICE_READ_OPTIONS,
+        populate_existing=True,
+    )
 
 
 def get_device_by_inventory(
@@ -28,69 +52,334 @@ def get_device_by_inventory(
     return db.scalar(stmt)
 
 
-def list_devices(
-    db: Session,
-    search: Optional[str] = None,
-    status_id: Optional[int] = None,
-    type_id: Optional[int] = None,
-    skip: int = 0,
-    limit: int = 50,
-) -> Tuple[int, List[models.Device]]:
-    stmt = (
-        select(models.Device)
-        .options(selectinload(models.Device.type), selectinload(models.Device.status))
-        .join(models.Device.type)
-        .join(models.Device.status)
-    )
-    if search:
-        like = f"%{search}%"
-        stmt = stmt.where(
-            or_(
-                models.Device.name.ilike(like),
-                models.Device.inventory_number.ilike(like),
-                models.Device.description.ilike(like),
-                models.DeviceType.name.ilike(like),
+def _encode_cursor(*values) -> str:
+    # Opaque token carrying the sort key of the last row of a page
+    raw = json.dumps(list(values)).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(cursor: str, *types) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError("Invalid cursor")
+    if not all(isinstance(v, t) for v, t in zip(values, types)):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def decode_device_cursor(cursor: str) -> Tuple[str, int]:
+    name, device_id = _decode_cursor(cursor, str, int)
+    return name, device_id
+
+
+def decode_loan_cursor(cursor: str) -> Tuple[datetime, int]:
+    loaned_at, loan_id = _decode_cursor(cursor, str, int)
+    try:
+        return datetime.fromisoformat(loaned_at), loan_id
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+def _exact_count(db: Session, stmt) -> int:
+    return db.scalar(select(func.count()).select_from(stmt.subquery()))
+
+
+def _estimated_count(db: Session, stmt, filtered: bool) -> Optional[int]:
+    """Row estimate from Postgres statistics, None when unavailable."""
+    dialect = db.get_bind().dialect
+    if dialect.name != "postgresql":
+        return None
+    if not filtered:
+        reltuples = db.scalar(
+            text(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = 'devices'::regclass"
             )
         )
+        # reltuples is -1 until the table has been vacuumed/analyzed
+        if reltuples is not None and reltuples >= 0:
+            return int(reltuples)
+    compiled = stmt.compile(dialect=dialect)
+    params = compiled.params
+    if compiled.positional:
+        # asyncpg ($1, $2...) takes positional parameters
+        params = tuple(params[name] for name in compiled.positiontup)
+    plan = (
+        db.connection()
+        .exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", params)
+        .scalar()
+    )
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def _cached_count(db: Session, stmt, key: tuple) -> int:
+    total = cache.device_totals.get(key)
+    if total is None:
+        total = _exact_count(db, stmt)
+        cache.device_totals.set(key, total)
+    return total
+
+
+def clear_device_total_cache() -> None:
+    cache.device_totals.clear()
+
+
+def _filter_devices(
+    dialect_name: str,
+    stmt,
+    search: Optional[str],
+    status_id: Optional[int],
+    type_id: Optional[int],
+):
+    """Listing filters over Device; returns (statement, search rank or None)."""
+    stmt = stmt.join(models.Device.type).join(models.Device.status)
+    rank = None
+    if search:
+        where, rank = device_search_clause(dialect_name, search)
+        stmt = stmt.where(where)
     if status_id:
         stmt = stmt.where(models.Device.status_id == status_id)
     if type_id:
         stmt = stmt.where(models.Device.type_id == type_id)
+    return stmt, rank
 
-    total = db.scalar(select(func.count()).select_from(stmt.subquery()))
-    items = db.scalars(stmt.offset(skip).limit(limit)).all()
-
-    # Attach open loans info (current loan) for each device
-    device_ids = [d.id for d in items]
-    if device_ids:
-        loan_stmt = (
-            select(models.Loan).options(
-                selectinload(models.Loan.borrower).load_only(
-                    models.User.first_name, models.User.last_name, models.User.username
-                )
-            )
-            .where(
-                models.Loan.device_id.in_(device_ids), models.Loan.returned_at.is_(None)
-            )
-            .order_by(models.Loan.loaned_at.desc())
+
+def _device_listing(
+    db: Session,
+    stmt,
+    search: Optional[str],
+    status_id: Optional[int],
+    type_id: Optional[int],
+    total_mode: schemas.TotalMode,
+):
+    """Apply the listing filters to a statement over Device and compute its total."""
+    stmt, rank = _filter_devices(
+        db.get_bind().dialect.name, stmt, search, status_id, type_id
+    )
+    total = None
+    if total_mode == schemas.TotalMode.estimated:
+        filtered = bool(search or status_id or type_id)
+        total = _estimated_count(db, stmt, filtered)
+        if total is None:
+            total_mode = schemas.TotalMode.exact
+    elif total_mode == schemas.TotalMode.cached:
+        total = _cached_count(db, stmt, (search, status_id, type_id))
+    if total_mode == schemas.TotalMode.exact:
+        total = _exact_count(db, stmt)
+    return stmt, rank, total, total_mode
+
+
+def _device_page(stmt, rank, skip: int, limit: int, cursor: Optional[str]):
+    """Order and bound a device statement; returns (statement, has one extra row)."""
+    if rank is not None and not cursor:
+        # Ranked search: best matches first, paginated with skip only
+        page_stmt = stmt.order_by(rank.desc(), models.Device.id.asc())
+        return page_stmt.offset(skip).limit(limit), False
+
+    # Stable (name, id) ordering so that a cursor can resume right after the last row
+    page_stmt = stmt.order_by(models.Device.name.asc(), models.Device.id.asc())
+    if cursor:
+        page_stmt = page_stmt.where(
+            tuple_(models.Device.name, models.Device.id)
+            > tuple_(*decode_device_cursor(cursor))
+        )
+    else:
+        page_stmt = page_stmt.offset(skip)
+    # Fetch one extra row to know whether another page exists
+    return page_stmt.limit(limit + 1), True
+
+
+def _display_name(first_name, last_name, username) -> str:
+    # Same rule as models.User.display_name
+    parts = [p for p in (first_name, last_name) if p]
+    return " ".join(parts) if parts else username
+
+
+_OPEN_LOAN = aliased(models.Loan, name="open_loan")
+_OPEN_LOAN_BORROWER = aliased(models.User, name="open_loan_borrower")
+_LOAN_ROW_COLUMNS = (
+    models.Loan.id,
+    models.Loan.device_id,
+    models.Loan.borrower_id,
+    models.Loan.usage_location,
+    models.Loan.loaned_at,
+    models.Loan.due_date,
+    models.Loan.returned_at,
+    models.Loan.notes,
+)
+_BORROWER_NAME_COLUMNS = (
+    models.User.first_name,
+    models.User.last_name,
+    models.User.username,
+)
+
+
+def _parse_fields(fields: Optional[str], model) -> Tuple[str, ...]:
+    """
+    Fields requested by ?fields=a,b (allow-list: the top-level fields of the response
+    model), in the model's order; every field when none is requested.
+    """
+    allowed = tuple(model.__fields__)
+    if not fields:
+        return allowed
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested.difference(allowed)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(name for name in allowed if name in requested)
+
+
+def _row_layout(fields, field_columns: dict, builders: dict, columns: list):
+    """
+    Append the columns of each field to the select list; returns (field, start, stop,
+    builder) entries for _row_dict. Fields without a builder are a single column.
+    """
+    layout = []
+    for field in fields:
+        field_cols = field_columns[field]
+        # A single column already selected (the cursor keys) is read from its position
+        start = next(
+            (i for i, column in enumerate(columns) if column is field_cols[0]), None
+        )
+        if start is None or len(field_cols) > 1:
+            start = len(columns)
+            columns.extend(field_cols)
+        layout.append((field, start, start + len(field_cols), builders.get(field)))
+    return layout
+
+
+def _row_dict(row, layout) -> dict:
+    return {
+        field: row[start] if build is None else build(*row[start:stop])
+        for field, start, stop, build in layout
+    }
+
+
+def _loan_dict(row, borrower) -> Optional[dict]:
+    """schemas.LoanRead as a dict from the 8 _LOAN_ROW_COLUMNS values."""
+    (
+        loan_id,
+        device_id,
+        borrower_id,
+        usage_location,
+        loaned_at,
+        due_date,
+        returned_at,
+        notes,
+    ) = row
+    if loan_id is None:
+        return None
+    return {
+        "id": loan_id,
+        "device_id": device_id,
+        "borrower_id": borrower_id,
+        "borrower_display_name": (
+            _display_name(*borrower) if borrower[2] is not None else None
+        ),
+        "usage_location": usage_location,
+        "loaned_at": loaned_at,
+        "due_date": due_date,
+        "returned_at": returned_at,
+        "notes": notes,
+    }
+
+
+_DEVICE_FIELD_COLUMNS = {
+    "inventory_number": (models.Device.inventory_number,),
+    "name": (models.Device.name,),
+    "description": (models.Device.description,),
+    "location": (models.Device.location,),
+    "type_id": (models.Device.type_id,),
+    "status_id": (models.Device.status_id,),
+    "security_level": (models.Device.security_level,),
+    "id": (models.Device.id,),
+    "type": (
+        models.DeviceType.name,
+        models.DeviceType.description,
+        models.Device.type_id,
+    ),
+    "status": (models.DeviceStatus.name, models.Device.status_id),
+    "current_loan": (
+        *(getattr(_OPEN_LOAN, column.key) for column in _LOAN_ROW_COLUMNS),
+        *(
+            getattr(_OPEN_LOAN_BORROWER, column.key)
+            for column in _BORROWER_NAME_COLUMNS
+        ),
+    ),
+}
+_DEVICE_FIELD_BUILDERS = {
+    "type": lambda name, description, id_: {
+        "name": name,
+        "description": description,
+        "id": id_,
+    },
+    "status": lambda name, id_: {"name": name, "id": id_},
+    "current_loan": lambda *values: _loan_dict(values[:8], values[8:]),
+}
+
+
+def _device_row_select(stmt, fields, columns: list):
+    """Select the columns of the requested fields after the given ones; (stmt, layout)."""
+    layout = _row_layout(fields, _DEVICE_FIELD_COLUMNS, _DEVICE_FIELD_BUILDERS, columns)
+    stmt = stmt.with_only_columns(*columns)
+    if "current_loan" in fields:
+        stmt = stmt.outerjoin(
+            _OPEN_LOAN, models.Device.current_loan_id == _OPEN_LOAN.id
+        ).outerjoin(
+            _OPEN_LOAN_BORROWER, _OPEN_LOAN.borrower_id == _OPEN_LOAN_BORROWER.id
         )
-        loans = db.scalars(loan_stmt).all()
-        latest_open = {}
-        for loan in loans:
-            if loan.device_id not in latest_open:
-                latest_open[loan.device_id] = schemas.LoanRead.from_orm(loan)
-        for d in items:
-            if d.id in latest_open:
-                setattr(d, "current_loan", latest_open[d.id])
-    return total, items
+    return stmt, layout
+
+
+def list_device_rows(
+    db: Session,
+    search: Optional[str] = None,
+    status_id: Optional[int] = None,
+    type_id: Optional[int] = None,
+    skip: int = 0,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    total_mode: schemas.TotalMode = schemas.TotalMode.exact,
+    fields: Optional[str] = None,
+) -> Tuple[Optional[int], schemas.TotalMode, List[dict], Optional[str]]:
+    """
+    Page of devices as plain dicts shaped like schemas.DeviceRead and built from
+    result tuples: no ORM identity map, no response-model validation.
+    With fields, only those DeviceRead fields are selected and returned.
+    """
+    fields = _parse_fields(fields, schemas.DeviceRead)
+    stmt, rank, total, total_mode = _device_listing(
+        db, select(models.Device.id), search, status_id, type_id, total_mode
+    )
+    page_stmt, extra_row = _device_page(stmt, rank, skip, limit, cursor)
+    # (name, id) first: the cursor is built from them whatever the fields
+    # Same FROM/WHERE as the counted statement, selecting the requested columns
+    page_stmt, layout = _device_row_select(
+        page_stmt, fields, [models.Device.name, models.Device.id]
+    )
+    rows = db.execute(page_stmt).all()
+    next_cursor = None
+    if extra_row and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1][0], rows[-1][1])
+    return total, total_mode, [_row_dict(row, layout) for row in rows], next_cursor
+
+
+def _touch(device: models.Device) -> None:
+    # New per-row version, so only this device's ETag changes
+    device.version = models.Device.version + 1
 
 
 def create_device(db: Session, device: schemas.DeviceCreate) -> models.Device:
     db_device = models.Device(**device.dict())
     db.add(db_device)
     db.commit()
-    db.refresh(db_device)
-    return db_device
+    clear_device_total_cache()
+    return get_device(db, db_device.id)
 
 
 def update_device(
@@ -98,14 +387,16 @@ def update_device(
 ) -> models.Device:
     for key, value in payload.dict(exclude_unset=True).items():
         setattr(db_device, key, value)
+    _touch(db_device)
     db.commit()
-    db.refresh(db_device)
-    return db_device
+    clear_device_total_cache()
+    return get_device(db, db_device.id)
 
 
 def delete_device(db: Session, db_device: models.Device) -> None:
     db.delete(db_device)
     db.commit()
+    clear_device_total_cache()
 
 
 def list_device_types(db: Session) -> List[models.DeviceType]:
@@ -117,7 +408,10 @@ def create_device_type(
 ) -> models.DeviceType:
     obj = models.DeviceType(**payload.dict())
     db.add(obj)
+    db.flush()
+    cache.bump_table_version(db, models.DeviceType.__tablename__)
     db.commit()
+    cache.device_types.invalidate()
     db.refresh(obj)
     return obj
 
@@ -137,18 +431,32 @@ def create_status(
 ) -> models.DeviceStatus:
     obj = models.DeviceStatus(**payload.dict())
     db.add(obj)
+    db.flush()
+    cache.bump_table_version(db, models.DeviceStatus.__tablename__)
     db.commit()
+    cache.statuses.invalidate()
     db.refresh(obj)
     return obj
 
 
 # Roles
 def ensure_roles_exist(db: Session):
-    for role in ALLOWED_ROLES:
-        existing = db.scalar(select(models.Role).where(models.Role.name == role))
-        if not existing:
-            db.add(models.Role(name=role))
+    if ALLOWED_ROLES <= cache.roles.all(db).keys():
+        return
+    existing = set(db.scalars(select(models.Role.name)).all())
+    missing = ALLOWED_ROLES - existing
+    if not missing:
+        return
+    for role in missing:
+        db.add(models.Role(name=role))
+    db.flush()
+    cache.bump_table_version(db, models.Role.__tablename__)
     db.commit()
+    cache.roles.invalidate()
+
+
+def list_test_users(db: Session) -> List[models.TestUser]:
+    return db.scalars(select(models.TestUser)).all()
 
 
 def list_roles(db: Session) -> List[models.Role]:
@@ -185,43 +493,178 @@ def upsert_user_with_roles(
         user.last_name = last_name
     role_objs = db.scalars(select(models.Role).where(models.Role.name.in_(roles))).all()
     user.roles = role_objs
+    cache.bump_table_version(db, models.User.__tablename__)
     db.commit()
+    cache.principals.invalidate(username)
     db.refresh(user)
     return user
 
 
-def list_users_with_roles(db: Session) -> List[models.User]:
-    return db.scalars(
-        select(models.User)
-        .options(selectinload(models.User.roles))
-        .order_by(models.User.username.asc())
-    ).all()
+def _upsert_insert(db: Session):
+    # INSERT supporting ON CONFLICT for the dialects used by this app
+    if db.get_bind().dialect.name == "sqlite":
+        return sqlite.insert
+    return postgresql.insert
 
 
-def update_user_profile(
+def provision_login_user(
     db: Session,
     username: str,
     email: Optional[str],
     first_name: Optional[str],
     last_name: Optional[str],
-) -> Optional[models.User]:
-    user = get_user(db, username)
-    if not user:
-        return None
-    changed = False
-    if email and not user.email:
-        user.email = email
-        changed = True
-    if first_name and not user.first_name:
-        user.first_name = first_name
-        changed = True
-    if last_name and not user.last_name:
-        user.last_name = last_name
+    auto_provision: bool,
+) -> Optional[List[str]]:
+    """
+    Login-time upsert in a single transaction: create the user or fill its missing
+    profile fields, then return its roles. A user without roles gets the default
+    ones (admin for the first user given roles, employee otherwise) when auto_provision
+    is on; otherwise nothing is written and None is returned.
+    """
+    ensure_roles_exist(db)
+    insert = _upsert_insert(db)
+    users = models.User.__table__
+    stmt = insert(users).values(
+        username=username, email=email, first_name=first_name, last_name=last_name
+    )
+    missing_fields = [
+        and_(users.c[name].is_(None), stmt.excluded[name].is_not(None))
+        for name in ("email", "first_name", "last_name")
+    ]
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[users.c.username],
+        set_={
+            "email": func.coalesce(users.c.email, stmt.excluded.email),
+            "first_name": func.coalesce(users.c.first_name, stmt.excluded.first_name),
+            "last_name": func.coalesce(users.c.last_name, stmt.excluded.last_name),
+        },
+        # Unchanged profiles are not rewritten (no row returned, no version bump)
+        where=or_(*missing_fields),
+    ).returning(users.c.id)
+    user_id = db.scalar(stmt)
+    changed = user_id is not None
+
+    roles = db.scalars(
+        select(models.Role.name)
+        .join(models.UserRole, models.UserRole.role_id == models.Role.id)
+        .join(models.User, models.User.id == models.UserRole.user_id)
+        .where(models.User.username == username)
+    ).all()
+    if not roles:
+        if not auto_provision:
+            db.rollback()
+            return None
+        if user_id is None:
+            user_id = db.scalar(
+                select(models.User.id).where(models.User.username == username)
+            )
+        # Users imported by the directory sync have no roles and do not count
+        has_other_user = db.scalar(
+            select(exists().where(models.UserRole.user_id != user_id))
+        )
+        roles = ["employee"] if has_other_user else ["admin"]
+        db.execute(
+            insert(models.UserRole.__table__)
+            .values(
+                [
+                    {"user_id": user_id, "role_id": cache.roles.get(db, name).id}
+                    for name in roles
+                ]
+            )
+            .on_conflict_do_nothing()
+        )
         changed = True
     if changed:
-        db.commit()
-        db.refresh(user)
-    return user
+        cache.bump_table_version(db, models.User.__tablename__)
+    db.commit()
+    cache.principals.invalidate(username)
+    return list(roles)
+
+
+def bulk_upsert_users(db: Session, profiles: List[dict]) -> int:
+    """
+    Insert or update many directory users in one statement (no roles assigned).
+    Directory values win over stored ones when present. Does not commit.
+    """
+    by_username = {p["username"]: p for p in profiles if p.get("username")}
+    if not by_username:
+        return 0
+    insert = _upsert_insert(db)
+    users = models.User.__table__
+    stmt = insert(users).values(
+        [
+            {
+                "username": p["username"],
+                "email": p.get("email"),
+                "first_name": p.get("first_name"),
+                "last_name": p.get("last_name"),
+            }
+            for p in by_username.values()
+        ]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[users.c.username],
+        set_={
+            "email": func.coalesce(stmt.excluded.email, users.c.email),
+            "first_name": func.coalesce(stmt.excluded.first_name, users.c.first_name),
+            "last_name": func.coalesce(stmt.excluded.last_name, users.c.last_name),
+        },
+    )
+    db.execute(stmt)
+    cache.bump_table_version(db, models.User.__tablename__)
+    return len(by_username)
+
+
+def list_users_with_roles(db: Session) -> List[models.User]:
+    return db.scalars(
+        select(models.User)
+        .options(selectinload(models.User.roles))
+        .order_by(models.User.username.asc())
+    ).all()
+
+
+def list_user_option_rows(db: Session) -> List[dict]:
+    """Users with their role names as dicts shaped like schemas.UserRead, one query."""
+    rows = db.execute(
+        select(
+            models.User.id,
+            models.User.username,
+            models.User.first_name,
+            models.User.last_name,
+            models.Role.name,
+        )
+        .outerjoin(models.UserRole, models.UserRole.user_id == models.User.id)
+        .outerjoin(models.Role, models.Role.id == models.UserRole.role_id)
+        .order_by(models.User.username.asc(), models.Role.name.asc())
+    ).all()
+    users: Dict[int, dict] = {}
+    for user_id, username, first_name, last_name, role in rows:
+        user = users.get(user_id)
+        if user is None:
+            user = users[user_id] = {
+                "username": username,
+                "display_name": _display_name(first_name, last_name, username),
+                "roles": [],
+            }
+        if role is not None:
+            user["roles"].append(role)
+    return list(users.values())
+
+
+def search_users(db: Session, q: str, limit: int = 10) -> List[models.User]:
+    where, order_by = user_search_clause(db.get_bind().dialect.name, q)
+    stmt = (
+        select(models.User)
+        .options(
+            load_only(
+                models.User.username, models.User.first_name, models.User.last_name
+            )
+        )
+        .where(where)
+        .order_by(*order_by)
+        .limit(limit)
+    )
+    return db.scalars(stmt).all()
 
 
 def _check_security(device: models.Device, user_roles: List[str]):
@@ -239,53 +682,56 @@ def _check_security(device: models.Device, user_roles: List[str]):
 def create_loan(
     db: Session,
     payload: schemas.LoanCreate,
-    status_loaned: models.DeviceStatus,
-    status_maintenance: models.DeviceStatus,
+    status_loaned: cache.LookupRow,
+    status_maintenance: cache.LookupRow,
     user_roles: List[str],
 ) -> models.Loan:
-    device = db.get(models.Device, payload.device_id)
+    # Row lock: concurrent loans/returns of the same device are serialized here
+    device = db.get(models.Device, payload.device_id, with_for_update=True)
     if not device:
         raise ValueError("Device not found")
     _check_security(device, user_roles)
     if device.status_id == status_maintenance.id:
         raise ValueError("Device is under maintenance")
-    if device.status_id == status_loaned.id:
-        raise ValueError("Device already loaned")
+    if device.status_id == status_loaned.id or device.current_loan_id is not None:
+        raise LoanConflictError("Device already loaned")
 
     borrower_user = db.get(models.User, payload.borrower_id)
     if not borrower_user:
         raise ValueError("Borrower not found")
     loan = models.Loan(**payload.dict())
     device.status_id = status_loaned.id
+    device.current_loan = loan
+    _touch(device)
     db.add(loan)
-    db.commit()
+    try:
+        db.flush()
+        db.commit()
+    except IntegrityError:
+        # uq_loans_open_device: another open loan won the race
+        db.rollback()
+        raise LoanConflictError("Device already loaned")
+    metrics.count_loan("loan")
     db.refresh(loan)
+    loan.borrower  # LoanRead.borrower_display_name, serialized after the session
     return loan
 
 
 def close_loan(
     db: Session,
     payload: schemas.LoanReturn,
-    status_available: models.DeviceStatus,
-    status_maintenance: models.DeviceStatus,
+    status_available: cache.LookupRow,
+    status_maintenance: cache.LookupRow,
     user_roles: List[str],
 ) -> models.Loan:
-    device = db.get(models.Device, payload.device_id)
+    device = db.get(models.Device, payload.device_id, with_for_update=True)
     if not device:
         raise ValueError("Device not found")
     _check_security(device, user_roles)
     if device.status_id == status_maintenance.id:
         raise ValueError("Device is under maintenance")
 
-    loan_stmt = (
-        select(models.Loan)
-        .where(
-            models.Loan.device_id == payload.device_id,
-            models.Loan.returned_at.is_(None),
-        )
-        .order_by(models.Loan.loaned_at.desc())
-    )
-    loan = db.scalar(loan_stmt)
+    loan = device.current_loan
     if not loan:
         raise ValueError("No open loan for device")
 
@@ -293,15 +739,211 @@ def close_loan(
     if payload.notes:
         loan.notes = payload.notes
     device.status_id = status_available.id
+    device.current_loan = None
+    _touch(device)
     db.commit()
+    metrics.count_loan("return")
     db.refresh(loan)
+    loan.borrower  # LoanRead.borrower_display_name, serialized after the session
     return loan
 
 
+def _loan_listing(
+    stmt,
+    state: Optional[schemas.LoanState],
+    borrower_id: Optional[int],
+    device_id: Optional[int],
+    loaned_from: Optional[datetime],
+    loaned_to: Optional[datetime],
+    overdue: bool,
+    limit: int,
+    cursor: Optional[str],
+):
+    stmt = _filter_loans(
+        stmt, state, borrower_id, device_id, loaned_from, loaned_to, overdue
+    )
+    if cursor:
+        stmt = stmt.where(
+            tuple_(models.Loan.loaned_at, models.Loan.id)
+            < tuple_(*decode_loan_cursor(cursor))
+        )
+    # One extra row tells whether another page exists
+    return stmt.limit(limit + 1)
+
+
+def _filter_loans(
+    stmt,
+    state: Optional[schemas.LoanState],
+    borrower_id: Optional[int],
+    device_id: Optional[int],
+    loaned_from: Optional[datetime],
+    loaned_to: Optional[datetime],
+    overdue: bool,
+):
+    # Newest first on (loaned_at, id), matching the ix_loans_*_loaned_at indexes
+    stmt = stmt.order_by(models.Loan.loaned_at.desc(), models.Loan.id.desc())
+    if state == schemas.LoanState.open:
+        stmt = stmt.where(models.Loan.returned_at.is_(None))
+    elif state == schemas.LoanState.returned:
+        stmt = stmt.where(models.Loan.returned_at.is_not(None))
+    if borrower_id:
+        stmt = stmt.where(models.Loan.borrower_id == borrower_id)
+    if device_id:
+        stmt = stmt.where(models.Loan.device_id == device_id)
+    if loaned_from:
+        stmt = stmt.where(models.Loan.loaned_at >= loaned_from)
+    if loaned_to:
+        stmt = stmt.where(models.Loan.loaned_at < loaned_to)
+    if overdue:
+        stmt = stmt.where(
+            models.Loan.returned_at.is_(None),
+            models.Loan.due_date < datetime.utcnow(),
+        )
+    return stmt
+
+
+_LOAN_FIELD_COLUMNS = {
+    **{column.key: (column,) for column in _LOAN_ROW_COLUMNS},
+    "borrower_display_name": _BORROWER_NAME_COLUMNS,
+}
+_LOAN_FIELD_BUILDERS = {
+    "borrower_display_name": lambda first_name, last_name, username: (
+        _display_name(first_name, last_name, username) if username is not None else None
+    ),
+}
+
+
+def _loan_row_select(fields, columns: list):
+    """Select the columns of the requested fields after the given ones; (stmt, layout)."""
+    layout = _row_layout(fields, _LOAN_FIELD_COLUMNS, _LOAN_FIELD_BUILDERS, columns)
+    stmt = select(*columns)
+    if "borrower_display_name" in fields:
+        stmt = stmt.outerjoin(models.User, models.Loan.borrower_id == models.User.id)
+    return stmt, layout
+
+
+def list_loan_rows(
+    db: Session,
+    state: Optional[schemas.LoanState] = None,
+    borrower_id: Optional[int] = None,
+    device_id: Optional[int] = None,
+    loaned_from: Optional[datetime] = None,
+    loaned_to: Optional[datetime] = None,
+    overdue: bool = False,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Page of loans, newest first, as dicts shaped like schemas.LoanRead.
+    With fields, only those LoanRead fields are selected and returned.
+    """
+    fields = _parse_fields(fields, schemas.LoanRead)
+    # (loaned_at, id) first: the cursor is built from them whatever the fields
+    stmt, layout = _loan_row_select(fields, [models.Loan.loaned_at, models.Loan.id])
+    stmt = _loan_listing(
+        stmt,
+        state,
+        borrower_id,
+        device_id,
+        loaned_from,
+        loaned_to,
+        overdue,
+        limit,
+        cursor,
+    )
+    rows = db.execute(stmt).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1][0].isoformat(), rows[-1][1])
+    return [_row_dict(row, layout) for row in rows], next_cursor
+
+
+def device_export_query(
+    dialect_name: str,
+    search: Optional[str] = None,
+    status_id: Optional[int] = None,
+    type_id: Optional[int] = None,
+    fields: Optional[str] = None,
+):
+    """
+    Whole filtered device list for an export, by id: (fields, statement, layout).
+    Built before streaming starts so that invalid fields are still a 400.
+    """
+    fields = _parse_fields(fields, schemas.DeviceRead)
+    stmt, _ = _filter_devices(
+        dialect_name, select(models.Device.id), search, status_id, type_id
+    )
+    stmt, layout = _device_row_select(stmt.order_by(models.Device.id), fields, [])
+    return fields, stmt, layout
+
+
+def loan_export_query(
+    state: Optional[schemas.LoanState] = None,
+    borrower_id: Optional[int] = None,
+    device_id: Optional[int] = None,
+    loaned_from: Optional[datetime] = None,
+    loaned_to: Optional[datetime] = None,
+    overdue: bool = False,
+    fields: Optional[str] = None,
+):
+    """Whole filtered loan history for an export: (fields, statement, layout)."""
+    fields = _parse_fields(fields, schemas.LoanRead)
+    stmt, layout = _loan_row_select(fields, [])
+    stmt = _filter_loans(
+        stmt, state, borrower_id, device_id, loaned_from, loaned_to, overdue
+    )
+    return fields, stmt, layout
+
+
+def stream_rows(
+    db: Session, stmt, layout, batch_size: int = 1000
+) -> Iterator[List[dict]]:
+    """
+    Rows of an export query as batches of dicts, read through a server-side cursor
+    (yield_per implies stream_results): memory stays bounded by batch_size.
+    """
+    result = db.execute(stmt.execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        yield [_row_dict(row, layout) for row in partition]
+
+
 def get_open_loan(db: Session, device_id: int) -> Optional[models.Loan]:
-    stmt = (
-        select(models.Loan)
-        .where(models.Loan.device_id == device_id, models.Loan.returned_at.is_(None))
+    device = db.get(models.Device, device_id)
+    return device.current_loan if device else None
+
+
+def repair_current_loans(
+    db: Session, dry_run: bool = False
+) -> List[Tuple[int, Optional[int], Optional[int]]]:
+    """
+    Realign devices.current_loan_id with the latest open loan of each device.
+    Returns (device_id, stored, expected) for every device that drifted.
+    """
+    latest_open_id = (
+        select(models.Loan.id)
+        .where(
+            models.Loan.device_id == models.Device.id,
+            models.Loan.returned_at.is_(None),
+        )
         .order_by(models.Loan.loaned_at.desc())
+        .limit(1)
+        .correlate(models.Device)
+        .scalar_subquery()
     )
-    return db.scalar(stmt)
+    expected = latest_open_id.label("expected")
+    drifted = db.execute(
+        select(models.Device.id, models.Device.current_loan_id, expected).where(
+            models.Device.current_loan_id.is_distinct_from(latest_open_id)
+        )
+    ).all()
+    if not dry_run and drifted:
+        for device_id, _, expected_id in drifted:
+            db.execute(
+                update(models.Device)
+                .where(models.Device.id == device_id)
+                .values(current_loan_id=expected_id, version=models.Device.version + 1)
+            )
+        db.commit()
+    return [tuple(row) for row in drifted]
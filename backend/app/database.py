@@ -1,11 +1,278 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
 
-from .config import get_settings
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
+
+from . import metrics
+from .config import Settings, get_settings
 
 settings = get_settings()
 
-engine = create_engine(settings.database_url, future=True)
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.timeouts += int(timed_out)
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            metrics.observe_pool_wait(waited)
+
+
+def engine_options(settings: Settings, url: str) -> dict:
+    """create_engine() keyword arguments for the configured pool and session settings."""
+    url = make_url(url)
+    if url.get_backend_name() != "postgresql":
+        # SQLite (tests/scripts): keep SQLAlchemy's pool defaults
+        return {}
+    options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle_seconds,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+    if url.get_driver_name() == "psycopg2":
+        pg_options = []
+        if settings.db_statement_timeout_ms:
+            pg_options.append(
+                f"-c statement_timeout={settings.db_statement_timeout_ms}"
+            )
+        connect_args = {"application_name": settings.db_application_name}
+        if pg_options:
+            connect_args["options"] = " ".join(pg_options)
+        options["connect_args"] = connect_args
+    return options
+
+
+def async_database_url(settings: Settings, url: Optional[str] = None) -> str:
+    if url is None and settings.database_async_url:
+        return settings.database_async_url
+    url = make_url(url or settings.database_url)
+    driver = "asyncpg" if url.get_backend_name() == "postgresql" else "aiosqlite"
+    return url.set(drivername=f"{url.get_backend_name()}+{driver}").render_as_string(
+        hide_password=False
+    )
+
+
+def async_engine_options(settings: Settings, url: str) -> dict:
+    """create_async_engine() keyword arguments, same pool settings as the sync engine."""
+    if make_url(url).get_backend_name() != "postgresql":
+        return {}
+    server_settings = {"application_name": settings.db_application_name}
+    if settings.db_statement_timeout_ms:
+        server_settings["statement_timeout"] = str(settings.db_statement_timeout_ms)
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle_seconds,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "connect_args": {"server_settings": server_settings},
+    }
+
+
+def pool_stats(engine) -> dict:
+    pool = engine.pool
+    stats = {"pool": pool.__class__.__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            # Negative while the pool has not yet opened pool_size connections
+            overflow=pool.overflow(),
+            # None when the pool keeps SQLAlchemy's defaults (SQLite)
+            max_overflow=engine_options(settings, engine.url).get("max_overflow"),
+            timeout_seconds=pool.timeout(),
+        )
+    if isinstance(pool, TimedQueuePool):
+        with pool._stats_lock:
+            stats.update(
+                checkouts=pool.checkouts,
+                timeouts=pool.timeouts,
+                wait_avg_seconds=(
+                    pool.wait_total / pool.checkouts if pool.checkouts else 0.0
+                ),
+                wait_max_seconds=pool.wait_max,
+            )
+    return stats
+
+
+def track_pool(engine, name: str) -> None:
+    """Publish the pool usage of an engine as metrics on every checkout/checkin."""
+
+    def on_checkout(*args):
+        if isinstance(engine.pool, QueuePool):
+            metrics.observe_checkout(name, engine.pool)
+
+    def on_checkin(*args):
+        if isinstance(engine.pool, QueuePool):
+            metrics.observe_checkin(name)
+
+    event.listen(engine, "checkout", on_checkout)
+    event.listen(engine, "checkin", on_checkin)
+
+
+class RequestWrites:
+    committed = False
+
+
+_request_writes: ContextVar[Optional[RequestWrites]] = ContextVar(
+    "request_writes", default=None
+)
+
+
+def track_writes() -> RequestWrites:
+    """Marker set when the current request commits INSERT/UPDATE/DELETE statements."""
+    writes = RequestWrites()
+    _request_writes.set(writes)
+    return writes
+
+
+# Registered on the Engine class like the instrumentation listeners: covers sync and
+# async engines. A transaction that only read (SELECT, /loans/scan) commits unmarked.
+@event.listens_for(Engine, "after_cursor_execute")
+def _note_dml(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and (
+        context.isinsert or context.isupdate or context.isdelete
+    ):
+        conn.info["dml_in_transaction"] = True
+
+
+@event.listens_for(Engine, "commit")
+def _mark_committed_writes(conn):
+    if conn.info.pop("dml_in_transaction", False):
+        writes = _request_writes.get()
+        if writes is not None:
+            writes.committed = True
+
+
+@event.listens_for(Engine, "rollback")
+def _forget_rolled_back_writes(conn):
+    conn.info.pop("dml_in_transaction", None)
+
+
+class RoutingSession(Session):
+    """
+    Session reading from the replica until it writes anything: flushes, DML and
+    SELECT ... FOR UPDATE go to the primary, and so does everything after them
+    (read-after-write within the session). Without a replica it is a plain Session.
+    """
+
+    def __init__(self, *args, replica=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replica = replica
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.replica is not None:
+            writes = self._flushing or (
+                clause is not None
+                and (
+                    getattr(clause, "is_dml", False)
+                    or getattr(clause, "_for_update_arg", None) is not None
+                )
+            )
+            if not writes:
+                return self.replica
+            self.replica = None
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+
+engine = create_engine(
+    settings.database_url,
+    future=True,
+    **engine_options(settings, settings.database_url),
+)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+track_pool(engine, "primary")
+
+read_engine = None
+if settings.database_read_url:
+    read_engine = create_engine(
+        settings.database_read_url,
+        future=True,
+        **engine_options(settings, settings.database_read_url),
+    )
+    track_pool(read_engine, "read")
+# Sessions of the read-only routes (dependencies.get_read_db)
+ReadSessionLocal = sessionmaker(
+    bind=engine,
+    class_=RoutingSession,
+    replica=read_engine,
+    autoflush=False,
+    autocommit=False,
+    future=True,
+)
+
+# Created on first use so that the sync mode does not need asyncpg installed
+async_engine: Optional[AsyncEngine] = None
+async_read_engine: Optional[AsyncEngine] = None
+AsyncSessionLocal: Optional[async_sessionmaker] = None
+AsyncReadSessionLocal: Optional[async_sessionmaker] = None
+_async_lock = threading.Lock()
+
+
+def _create_async_engine(url: str) -> AsyncEngine:
+    return create_async_engine(url, **async_engine_options(settings, url))
+
+
+def _init_async() -> None:
+    global async_engine, async_read_engine, AsyncSessionLocal, AsyncReadSessionLocal
+    async_engine = _create_async_engine(async_database_url(settings))
+    track_pool(async_engine.sync_engine, "async")
+    replica = None
+    if settings.database_read_url:
+        async_read_engine = _create_async_engine(
+            async_database_url(settings, settings.database_read_url)
+        )
+        track_pool(async_read_engine.sync_engine, "async_read")
+        replica = async_read_engine.sync_engine
+    # No expiry on commit: attributes cannot lazy-load outside the session
+    AsyncSessionLocal = async_sessionmaker(
+        bind=async_engine, autoflush=False, expire_on_commit=False
+    )
+    AsyncReadSessionLocal = async_sessionmaker(
+        bind=async_engine,
+        sync_session_class=RoutingSession,
+        replica=replica,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+
+def get_async_sessionmaker(read: bool = False) -> async_sessionmaker:
+    if AsyncSessionLocal is None:
+        with _async_lock:
+            if AsyncSessionLocal is None:
+                _init_async()
+    return AsyncReadSessionLocal if read else AsyncSessionLocal
+
 
 Base = declarative_base()
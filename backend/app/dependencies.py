@@ -1,9 +1,13 @@
-from typing import Generator
-from fastapi import Depends
+import time
+from typing import AsyncGenerator, Generator
+from fastapi import Depends, HTTPException, Request, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from .database import SessionLocal
+from .config import get_settings
+from .database import ReadSessionLocal, SessionLocal, get_async_sessionmaker
 from .auth import get_current_user
+from .executors import AsyncExecutor, SyncExecutor
 
 
 def get_db() -> Generator[Session, None, None]:
@@ -14,5 +18,73 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+# Server time of the client's last successful write, set on write responses and sent
+# back by the client: reads within READ_AFTER_WRITE_SECONDS go to the primary
+LAST_WRITE_HEADER = "X-Last-Write"
+
+
+def _wrote_recently(request: Request) -> bool:
+    try:
+        written_at = float(request.headers.get(LAST_WRITE_HEADER, ""))
+    except ValueError:
+        return False
+    age = time.time() - written_at
+    return 0 <= age < get_settings().read_after_write_seconds
+
+
+def get_read_db(request: Request) -> Generator[Session, None, None]:
+    """Session of the read-only routes, on the replica when DATABASE_READ_URL is set."""
+    db = SessionLocal() if _wrote_recently(request) else ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+
+async def get_async_read_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    read = not _wrote_recently(request)
+    async with get_async_sessionmaker(read=read)() as db:
+        yield db
+
+
+async def _sync_executor(db: Session = Depends(get_db)) -> SyncExecutor:
+    return SyncExecutor(db)
+
+
+async def _sync_read_executor(db: Session = Depends(get_read_db)) -> SyncExecutor:
+    return SyncExecutor(db)
+
+
+async def _async_executor(db: AsyncSession = Depends(get_async_db)) -> AsyncExecutor:
+    return AsyncExecutor(db)
+
+
+async def _async_read_executor(
+    db: AsyncSession = Depends(get_async_read_db),
+) -> AsyncExecutor:
+    return AsyncExecutor(db)
+
+
+# Database of the devices, loans and catalog routers: DB_ASYNC=true runs the same
+# route bodies on AsyncSession/asyncpg instead of a Session in the threadpool
+if get_settings().db_async:
+    get_executor, get_read_executor = _async_executor, _async_read_executor
+else:
+    get_executor, get_read_executor = _sync_executor, _sync_read_executor
+
+
 def get_user(user=Depends(get_current_user)):
     return user
+
+
+def get_admin_user(user=Depends(get_current_user)):
+    if "admin" not in set(user.get("roles", [])):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admin role required"
+        )
+    return user
@@ -0,0 +1,67 @@
+"""
+Conditional GET: ETags built from table_versions counters (catalog, user options) or
+from the device's own version column, so that a matching If-None-Match is answered 304
+after primary-key lookups, before the endpoint runs its query or serializes anything.
+ETags are weak: CompressionMiddleware re-encodes the body without changing them.
+"""
+
+from typing import Optional
+
+from fastapi import Request, Response
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import cache, models
+
+# Cache-Control per endpoint family. Everything is private (per user token) and
+# revalidated; the catalog may be reused for a short while without asking.
+CATALOG_CACHE_CONTROL = "private, max-age=30, must-revalidate"
+USERS_CACHE_CONTROL = "private, no-cache"
+DEVICE_CACHE_CONTROL = "private, no-cache"
+
+# Other tables whose rows appear in a DeviceRead; the device row and its current loan
+# are covered by devices.version
+DEVICE_TABLES = ("device_types", "device_statuses", "users")
+
+
+def table_etag(db: Session, *table_names: str, key: str = "") -> str:
+    versions = cache.get_table_versions(db, table_names)
+    parts = [f"{name}.{versions[name]}" for name in table_names]
+    if key:
+        parts.append(key)
+    return 'W/"' + "-".join(parts) + '"'
+
+
+def device_etag(db: Session, device_id: int) -> Optional[str]:
+    """ETag of GET /devices/{id}, or None if the device does not exist."""
+    version = db.scalar(
+        select(models.Device.version).where(models.Device.id == device_id)
+    )
+    if version is None:
+        return None
+    return table_etag(db, *DEVICE_TABLES, key=f"{device_id}.{version}")
+
+
+def _matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison: ignore W/ prefixes
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def not_modified(request: Request, etag: str, cache_control: str) -> Optional[Response]:
+    """A 304 response if the client already has this version, else None."""
+    if not _matches(request, etag):
+        return None
+    return Response(
+        status_code=304, headers={"ETag": etag, "Cache-Control": cache_control}
+    )
+
+
+def set_headers(response: Response, etag: str, cache_control: str) -> None:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
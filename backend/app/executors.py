@@ -0,0 +1,56 @@
+"""
+Database executors of the devices, loans and catalog routers. The route bodies are
+written once and call crud through an executor: SyncExecutor runs the crud function on
+a Session in the AnyIO threadpool, AsyncExecutor runs the same function on an
+AsyncSession (DB_ASYNC=true, asyncpg) through run_sync. Statements are only built in
+crud; the executors decide where they run.
+"""
+
+from typing import AsyncIterator, Callable, Iterator, List, TypeVar, Union
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import crud
+
+T = TypeVar("T")
+
+
+class SyncExecutor:
+    def __init__(self, session: Session):
+        self.session = session
+
+    @property
+    def dialect_name(self) -> str:
+        return self.session.get_bind().dialect.name
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        return await run_in_threadpool(fn, self.session, *args, **kwargs)
+
+    def stream(self, stmt, layout, batch_size: int = 1000) -> Iterator[List[dict]]:
+        # Iterated in the threadpool by StreamingResponse
+        return crud.stream_rows(self.session, stmt, layout, batch_size=batch_size)
+
+
+class AsyncExecutor:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    @property
+    def dialect_name(self) -> str:
+        return self.session.sync_session.get_bind().dialect.name
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        return await self.session.run_sync(fn, *args, **kwargs)
+
+    async def stream(
+        self, stmt, layout, batch_size: int = 1000
+    ) -> AsyncIterator[List[dict]]:
+        """crud.stream_rows on a server-side cursor (AsyncSession.stream)."""
+        result = await self.session.stream(stmt.execution_options(yield_per=batch_size))
+        async for partition in result.partitions():
+            yield [crud._row_dict(row, layout) for row in partition]
+
+
+Executor = Union[SyncExecutor, AsyncExecutor]
@@ -0,0 +1,124 @@
+"""
+Per-request database instrumentation: statement count and time spent in the database,
+reported in a Server-Timing header and logged above configurable thresholds.
+Statements executed outside a request (scripts, background sync) are not tracked.
+"""
+
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        # CPU time of response compression (app.compression)
+        self.compress_seconds = 0.0
+        self.statements: Counter = Counter()
+
+    def repeated(self, threshold: int) -> list:
+        """Statements executed at least threshold times (suspected N+1)."""
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar(
+    "request_db_stats", default=None
+)
+
+
+def start_request() -> RequestStats:
+    stats = RequestStats()
+    _current.set(stats)
+    return stats
+
+
+def current() -> Optional[RequestStats]:
+    return _current.get()
+
+
+# Registered on the Engine class: covers the primary, the replica and async engines.
+# The start time lives on the execution context, which is dropped with the statement
+# whether it succeeds or fails, so nothing stale stays on the pooled connection.
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None and context is not None:
+        context._instrumentation_started = time.perf_counter()
+
+
+def _record(context, statement: str) -> None:
+    stats = _current.get()
+    started = getattr(context, "_instrumentation_started", None)
+    if stats is None or started is None:
+        return
+    context._instrumentation_started = None
+    stats.db_seconds += time.perf_counter() - started
+    stats.queries += 1
+    stats.statements[statement] += 1
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record(context, statement)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # Failed statements count too (timeouts, constraint violations)
+    if exception_context.execution_context is not None:
+        _record(exception_context.execution_context, exception_context.statement)
+
+
+def server_timing(stats: RequestStats, total_seconds: float) -> str:
+    app_seconds = total_seconds - stats.db_seconds - stats.compress_seconds
+    timing = (
+        f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.queries} queries", '
+        f"app;dur={app_seconds * 1000:.1f}"
+    )
+    if stats.compress_seconds:
+        timing += f", compress;dur={stats.compress_seconds * 1000:.1f}"
+    return timing
+
+
+def log_request(
+    method: str,
+    path: str,
+    stats: RequestStats,
+    total_seconds: float,
+    slow_ms: int,
+    max_queries: int,
+    n_plus_one_threshold: int,
+) -> None:
+    total_ms = total_seconds * 1000
+    if (slow_ms and total_ms >= slow_ms) or (
+        max_queries and stats.queries >= max_queries
+    ):
+        logger.warning(
+            "%s %s: %.1f ms, %d queries, %.1f ms in DB, %.1f ms compressing",
+            method,
+            path,
+            total_ms,
+            stats.queries,
+            stats.db_seconds * 1000,
+            stats.compress_seconds * 1000,
+        )
+    if n_plus_one_threshold:
+        for statement, count in stats.repeated(n_plus_one_threshold):
+            logger.warning(
+                "Possible N+1 on %s %s: statement run %d times: %s",
+                method,
+                path,
+                count,
+                " ".join(statement.split())[:300],
+            )
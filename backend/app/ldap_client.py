@@ -0,0 +1,413 @@
+import asyncio
+import queue
+import re
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from ldap3 import NONE, SYNC, Connection, Server, Tls
+from ldap3.utils.uri import parse_uri
+
+from .config import Settings, get_settings
+
+# Attributes read for a login/profile lookup
+PROFILE_ATTRIBUTES = [
+    "cn",
+    "uid",
+    "sAMAccountName",
+    "distinguishedName",
+    "displayName",
+    "mail",
+    "givenName",
+    "sn",
+]
+
+# Swapped for ldap3.MOCK_SYNC in tests/offline runs
+CLIENT_STRATEGY = SYNC
+
+
+class LdapUnavailableError(Exception):
+    """The directory cannot be reached (down, slow, or circuit breaker open)."""
+
+
+class LdapBusyError(Exception):
+    """Every service connection stayed in use for LDAP_POOL_WAIT_TIMEOUT."""
+
+
+class _SharedServer(Server):
+    """
+    Server shared by every login for the life of the process. ldap3 would skip an
+    address for RESET_AVAILABILITY_TIMEOUT after one failed connect ("invalid server
+    address", counted by the breaker); every connect tries it again instead.
+    """
+
+    def update_availability(self, address, available):
+        pass
+
+
+_server: Optional[Server] = None
+_service_pool: Optional["ServiceConnectionPool"] = None
+_lock = threading.Lock()
+
+
+def username_attribute(settings: Settings) -> Optional[str]:
+    """Attribute LDAP_SEARCH_FILTER compares with {username} (uid, sAMAccountName...)."""
+    match = re.search(r"\(([A-Za-z][\w-]*)=\{username\}\)", settings.ldap_search_filter)
+    return match.group(1) if match else None
+
+
+def first_value(attrs: dict, name: str):
+    value = attrs.get(name)
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return value
+
+
+def profile_from_attrs(attrs: dict, username: str) -> dict:
+    first_name = first_value(attrs, "givenName")
+    last_name = first_value(attrs, "sn")
+    email = first_value(attrs, "mail")
+    username_out = first_value(attrs, "sAMAccountName") or username
+    display_name = (
+        first_value(attrs, "displayName")
+        or " ".join(filter(None, [first_name, last_name]))
+        or username_out
+    )
+    return {
+        "username": username_out,
+        "email": email,
+        "first_name": first_name,
+        "last_name": last_name,
+        "display_name": display_name,
+    }
+
+
+def _build_server(settings: Settings) -> Server:
+    # Force TLS 1.2 and a commonly accepted cipher for AD/LDAPS endpoints that reset on defaults
+    tls_config = Tls(
+        validate=ssl.CERT_NONE,
+        version=ssl.PROTOCOL_TLSv1_2,
+        ciphers="ECDHE-RSA-AES256-GCM-SHA384",
+    )
+    uri = parse_uri(settings.ldap_server)
+    # get_info=NONE: no schema/DSA download, we only bind and search
+    return _SharedServer(
+        settings.ldap_server,
+        get_info=NONE,
+        use_ssl=uri["ssl"],
+        tls=tls_config,
+        connect_timeout=settings.ldap_connect_timeout,
+    )
+
+
+def new_connection(
+    server: Server, user: str, password: str, receive_timeout: int, **kwargs
+) -> Connection:
+    return Connection(
+        server,
+        user=user,
+        password=password,
+        client_strategy=CLIENT_STRATEGY,
+        receive_timeout=receive_timeout,
+        **kwargs,
+    )
+
+
+def get_server(settings: Settings) -> Server:
+    global _server
+    if _server is None:
+        with _lock:
+            if _server is None:
+                _server = _build_server(settings)
+    return _server
+
+
+class ServiceConnectionPool:
+    """
+    Bound connections of the service account (LDAP_BIND_DN), reused across logins.
+    Connections that failed are dropped and replaced on the next checkout.
+    """
+
+    def __init__(
+        self,
+        server: Server,
+        user: str,
+        password: str,
+        size: int,
+        receive_timeout: int,
+        wait_timeout: float,
+    ):
+        self.server = server
+        self.user = user
+        self.password = password
+        self.size = size
+        self.receive_timeout = receive_timeout
+        self.wait_timeout = wait_timeout
+        self._idle: "queue.LifoQueue[Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> Connection:
+        return new_connection(
+            self.server,
+            self.user,
+            self.password,
+            self.receive_timeout,
+            auto_bind=True,
+        )
+
+    def _checkout(self) -> Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.wait_timeout)
+        except queue.Empty:
+            # Local saturation, not a directory failure: kept out of the breaker
+            raise LdapBusyError("No LDAP service connection available")
+
+    def _discard(self, conn: Connection) -> None:
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.unbind()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self) -> Iterator[Connection]:
+        conn = self._checkout()
+        if conn.closed or not conn.bound:
+            try:
+                conn.open()
+                conn.bind()
+            except Exception:
+                self._discard(conn)
+                raise
+        try:
+            yield conn
+        except Exception:
+            self._discard(conn)
+            raise
+        else:
+            self._idle.put(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+
+def get_service_pool(settings: Settings) -> Optional[ServiceConnectionPool]:
+    """Shared pool of the service account, None when no service account is configured."""
+    global _service_pool
+    if not (settings.ldap_bind_dn and settings.ldap_bind_password):
+        return None
+    if _service_pool is None:
+        with _lock:
+            if _service_pool is None:
+                _service_pool = ServiceConnectionPool(
+                    get_server(settings),
+                    user=settings.ldap_bind_dn,
+                    password=settings.ldap_bind_password,
+                    size=settings.ldap_pool_size,
+                    receive_timeout=settings.ldap_receive_timeout,
+                    wait_timeout=settings.ldap_pool_wait_timeout,
+                )
+    return _service_pool
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive infrastructure failures and rejects
+    calls for reset_seconds; then lets a single trial call through (half-open).
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class LdapRunner:
+    """
+    Dedicated bounded executor for blocking LDAP calls, so a slow directory cannot
+    exhaust the AnyIO threadpool shared with the rest of the API.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue: int,
+        operation_timeout: float,
+        breaker: CircuitBreaker,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.operation_timeout = operation_timeout
+        self.breaker = breaker
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="ldap"
+        )
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._calls = 0
+        self._failures = 0
+        self._rejected = 0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+
+    def _dequeue(self, ticket: dict) -> None:
+        # Called by whichever comes first: the worker starting or the caller timing out
+        with self._lock:
+            if ticket["queued"]:
+                ticket["queued"] = False
+                self._queued -= 1
+
+    def _call(self, ticket: dict, func: Callable, args: tuple, kwargs: dict) -> Any:
+        self._dequeue(ticket)
+        with self._lock:
+            self._running += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _observe(self, started: float, failed: bool) -> None:
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._calls += 1
+            self._failures += int(failed)
+            self._latency_sum += elapsed
+            self._latency_max = max(self._latency_max, elapsed)
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Run func in the LDAP executor. Communication errors and timeouts count as
+        breaker failures and surface as LdapUnavailableError; LdapBusyError (pool
+        saturated) leaves the breaker as is; other exceptions (e.g. invalid
+        credentials) are re-raised as is.
+        """
+        with self._lock:
+            full = self._queued >= self.max_queue
+        if full or not self.breaker.allow():
+            with self._lock:
+                self._rejected += 1
+            raise LdapUnavailableError("LDAP temporarily unavailable")
+        ticket = {"queued": True}
+        with self._lock:
+            self._queued += 1
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            self._executor, self._call, ticket, func, args, kwargs
+        )
+        try:
+            result = await asyncio.wait_for(future, timeout=self.operation_timeout)
+        except (asyncio.TimeoutError, LdapUnavailableError) as exc:
+            self._dequeue(ticket)
+            self.breaker.record_failure()
+            self._observe(started, failed=True)
+            raise LdapUnavailableError(str(exc) or "LDAP operation timed out")
+        except LdapBusyError:
+            self._observe(started, failed=False)
+            raise
+        except Exception:
+            # Application-level failure: the directory answered
+            self.breaker.record_success()
+            self._observe(started, failed=False)
+            raise
+        self.breaker.record_success()
+        self._observe(started, failed=False)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued": self._queued,
+                "running": self._running,
+                "max_concurrency": self.max_concurrency,
+                "calls": self._calls,
+                "failures": self._failures,
+                "rejected": self._rejected,
+                "latency_avg_seconds": (
+                    self._latency_sum / self._calls if self._calls else 0.0
+                ),
+                "latency_max_seconds": self._latency_max,
+                "breaker": self.breaker.state,
+            }
+
+
+_runner: Optional[LdapRunner] = None
+
+
+def get_runner() -> LdapRunner:
+    global _runner
+    if _runner is None:
+        with _lock:
+            if _runner is None:
+                settings = get_settings()
+                _runner = LdapRunner(
+                    max_concurrency=settings.ldap_max_concurrency,
+                    max_queue=settings.ldap_max_queue,
+                    operation_timeout=settings.ldap_operation_timeout,
+                    breaker=CircuitBreaker(
+                        failure_threshold=settings.ldap_breaker_failure_threshold,
+                        reset_seconds=settings.ldap_breaker_reset_seconds,
+                    ),
+                )
+    return _runner
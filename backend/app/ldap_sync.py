@@ -0,0 +1,186 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from . import cache, crud, ldap_client, models
+from .config import Settings
+from .database import SessionLocal, engine
+
+logger = logging.getLogger("uvicorn.error")
+
+STATE_NAME = "users"
+PAGED_RESULTS_OID = "1.2.840.113556.1.4.319"
+# Arbitrary key so that only one worker runs the periodic sync (Postgres only)
+ADVISORY_LOCK_KEY = 727001
+
+# The directory is read in fixed shards by prefix of the username attribute (the one
+# LDAP_SEARCH_FILTER compares with {username}: uid, sAMAccountName...), each paged on
+# its own. A shard is checkpointed once fully imported: an interrupted run skips the
+# completed shards without reading them again and redoes the one it was in (the
+# upserts are idempotent), whatever order the directory returns entries in.
+USERNAME_PREFIXES = tuple("0123456789abcdefghijklmnopqrstuvwxyz")
+OTHER_SHARD = "other"
+SHARDS = USERNAME_PREFIXES + (OTHER_SHARD,)
+
+
+def _shard_filter(search_filter: str, attribute: str, shard: str) -> str:
+    if shard == OTHER_SHARD:
+        excluded = "".join(
+            f"(!({attribute}={prefix}*))" for prefix in USERNAME_PREFIXES
+        )
+        return f"(&{search_filter}{excluded})"
+    # Username attributes match case-insensitively: "a*" also covers "A..."
+    return f"(&{search_filter}({attribute}={shard}*))"
+
+
+def _load_state(db: Session, resume: bool) -> models.LdapSyncState:
+    state = db.get(models.LdapSyncState, STATE_NAME)
+    if state is None:
+        state = models.LdapSyncState(name=STATE_NAME)
+        db.add(state)
+    if not resume or state.finished_at is not None or state.started_at is None:
+        state.pages_done = 0
+        state.users_done = 0
+        state.last_shard = None
+        state.started_at = datetime.utcnow()
+        state.finished_at = None
+    db.commit()
+    return state
+
+
+def sync_users(settings: Settings, resume: bool = True) -> dict:
+    """
+    Page through the directory (paged results control) shard by shard and bulk-upsert
+    users. An interrupted run resumes after the last completed shard.
+    """
+    if not (settings.ldap_bind_dn and settings.ldap_bind_password):
+        raise RuntimeError("LDAP_BIND_DN/LDAP_BIND_PASSWORD required for the sync")
+    attribute = ldap_client.username_attribute(settings)
+    if attribute is None:
+        raise RuntimeError("LDAP_SEARCH_FILTER must contain (<attribute>={username})")
+    started = time.monotonic()
+    search_filter = settings.ldap_search_filter.format(username="*")
+    attributes = ldap_client.PROFILE_ATTRIBUTES
+    if attribute not in attributes:
+        attributes = attributes + [attribute]
+    report = {"pages": 0, "skipped_shards": 0, "entries": 0, "upserted": 0}
+
+    with SessionLocal() as db:
+        state = _load_state(db, resume)
+        if state.last_shard in SHARDS:
+            report["skipped_shards"] = SHARDS.index(state.last_shard) + 1
+        conn = ldap_client.new_connection(
+            ldap_client.get_server(settings),
+            settings.ldap_bind_dn,
+            settings.ldap_bind_password,
+            settings.ldap_receive_timeout,
+        )
+        if not conn.bind():
+            raise RuntimeError(f"LDAP service bind failed: {conn.result}")
+        try:
+            for shard in SHARDS[report["skipped_shards"] :]:
+                cookie = None
+                while True:
+                    conn.search(
+                        search_base=settings.ldap_search_base,
+                        search_filter=_shard_filter(search_filter, attribute, shard),
+                        attributes=attributes,
+                        paged_size=settings.ldap_sync_page_size,
+                        paged_cookie=cookie,
+                    )
+                    profiles = []
+                    for entry in conn.entries:
+                        attrs = entry.entry_attributes_as_dict
+                        username = ldap_client.first_value(attrs, attribute)
+                        profile = ldap_client.profile_from_attrs(attrs, username)
+                        if profile["username"]:
+                            profiles.append(profile)
+                    report["pages"] += 1
+                    report["entries"] += len(conn.entries)
+                    upserted = crud.bulk_upsert_users(db, profiles)
+                    report["upserted"] += upserted
+                    state.pages_done += 1
+                    state.users_done += upserted
+                    db.commit()
+                    controls = conn.result.get("controls") or {}
+                    cookie = (
+                        controls.get(PAGED_RESULTS_OID, {})
+                        .get("value", {})
+                        .get("cookie")
+                    )
+                    if not cookie:
+                        break
+                state.last_shard = shard
+                db.commit()
+        finally:
+            conn.unbind()
+        state.finished_at = datetime.utcnow()
+        db.commit()
+    # Profiles may have changed for users with cached principals
+    cache.principals.clear()
+    report["duration_seconds"] = round(time.monotonic() - started, 3)
+    return report
+
+
+def _try_lock(conn: Connection) -> bool:
+    if conn.dialect.name != "postgresql":
+        return True
+    return bool(
+        conn.scalar(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY}
+        )
+    )
+
+
+def _unlock(conn: Connection) -> None:
+    if conn.dialect.name == "postgresql":
+        conn.execute(
+            text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY}
+        )
+
+
+def _finished_since(moment: datetime) -> bool:
+    with SessionLocal() as db:
+        state = db.get(models.LdapSyncState, STATE_NAME)
+        return bool(state and state.finished_at and state.finished_at > moment)
+
+
+def _periodic_sync(settings: Settings, stop: threading.Event) -> None:
+    interval = settings.ldap_sync_interval_minutes * 60
+    last_check = datetime.utcnow()
+    while not stop.wait(interval):
+        # Session-level advisory lock on its own autocommit connection: it lasts
+        # until unlocked, without keeping a transaction open during the sync
+        with engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as lock_conn:
+            if not _try_lock(lock_conn):
+                continue
+            try:
+                # Another worker already synced during this interval
+                if _finished_since(last_check):
+                    continue
+                report = sync_users(settings)
+                logger.info("LDAP sync done: %s", report)
+            except Exception as exc:
+                logger.warning("LDAP sync failed: %s", exc)
+            finally:
+                _unlock(lock_conn)
+                last_check = datetime.utcnow()
+
+
+def start_background_sync(settings: Settings) -> Optional[threading.Event]:
+    """Start the periodic sync thread if enabled; returns the event that stops it."""
+    if settings.ldap_sync_interval_minutes <= 0:
+        return None
+    stop = threading.Event()
+    threading.Thread(
+        target=_periodic_sync, args=(settings, stop), name="ldap-sync", daemon=True
+    ).start()
+    return stop
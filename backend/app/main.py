@@ -1,12 +1,19 @@
-from fastapi import FastAPI, Depends
+import secrets
+import time
+
+from fastapi import FastAPI, Depends, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy import text
 
-from .database import Base, engine
+from .database import Base, engine, pool_stats
 from .config import get_settings
+from .search import ensure_search_schema
 from .auth import login, get_current_user
 from .routers import devices, loans, catalog, users
+from . import database, instrumentation, ldap_client, ldap_sync, metrics
+from .compression import CompressionMiddleware
+from .dependencies import LAST_WRITE_HEADER, get_admin_user
 
 settings = get_settings()
 
@@ -29,12 +36,29 @@ def apply_dev_migrations():
                 "ALTER TABLE IF EXISTS devices ADD COLUMN IF NOT EXISTS location VARCHAR(200) NULL;"
             )
         )
+        conn.execute(
+            text(
+                "ALTER TABLE IF EXISTS devices ADD COLUMN IF NOT EXISTS current_loan_id INTEGER NULL REFERENCES loans(id);"
+            )
+        )
+        conn.execute(
+            text(
+                "ALTER TABLE IF EXISTS devices ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;"
+            )
+        )
+        conn.execute(
+            text(
+                "ALTER TABLE IF EXISTS ldap_sync_state ADD COLUMN IF NOT EXISTS last_shard VARCHAR(16) NULL;"
+            )
+        )
 
 
 # Create/patch schema only in dev to avoid clashes with Alembic-managed envs
 if settings.environment == "dev":
     apply_dev_migrations()
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        ensure_search_schema(conn)
 
 app = FastAPI(title=settings.app_name, debug=settings.debug)
 
@@ -44,15 +68,81 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[LAST_WRITE_HEADER],
 )
+if settings.compression_enabled:
+    # Inside instrument_db, so the compression CPU lands in the request's Server-Timing
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.compression_minimum_size,
+        gzip_level=settings.gzip_level,
+        brotli_quality=settings.brotli_quality,
+    )
+
+
+@app.middleware("http")
+async def pin_writers_to_primary(request: Request, call_next):
+    if not settings.database_read_url:
+        return await call_next(request)
+    # Read-after-write: the replica may lag behind what this client just committed.
+    # Only requests that committed a write are stamped, not read-only POSTs (scan).
+    writes = database.track_writes()
+    response = await call_next(request)
+    if writes.committed:
+        response.headers[LAST_WRITE_HEADER] = f"{time.time():.3f}"
+    return response
+
+
+@app.middleware("http")
+async def instrument_db(request: Request, call_next):
+    if not settings.db_instrumentation:
+        return await call_next(request)
+    stats = instrumentation.start_request()
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    response.headers["Server-Timing"] = instrumentation.server_timing(stats, elapsed)
+    instrumentation.log_request(
+        request.method,
+        request.url.path,
+        stats,
+        elapsed,
+        slow_ms=settings.slow_request_log_ms,
+        max_queries=settings.slow_request_log_queries,
+        n_plus_one_threshold=settings.n_plus_one_log_threshold,
+    )
+    return response
+
+
+if settings.metrics_enabled:
+    # Added last so it is outermost and its latency covers the other middlewares
+    app.add_middleware(metrics.MetricsMiddleware)
+
+
+@app.on_event("startup")
+def start_ldap_sync():
+    # Optional periodic directory import (LDAP_SYNC_INTERVAL_MINUTES > 0)
+    app.state.ldap_sync_stop = ldap_sync.start_background_sync(settings)
+
+
+@app.on_event("shutdown")
+def stop_ldap_sync():
+    stop = getattr(app.state, "ldap_sync_stop", None)
+    if stop is not None:
+        stop.set()
+
+
+@app.on_event("shutdown")
+def release_metrics():
+    metrics.mark_process_dead()
 
 
 @app.post("/auth/token")
-def auth_token(
+async def auth_token(
     form_data: OAuth2PasswordRequestForm = Depends(), settings_dep=Depends(get_settings)
 ):
     # Pass resolved settings explicitly to avoid Depends object
-    return login(form_data=form_data, settings=settings_dep)
+    return await login(form_data=form_data, settings=settings_dep)
 
 
 @app.get("/health")
@@ -60,6 +150,38 @@ def health():
     return {"status": "ok", "environment": settings.environment}
 
 
+@app.get("/health/ldap")
+def health_ldap():
+    # Login executor queue depth, latency and circuit breaker state
+    return ldap_client.get_runner().stats()
+
+
+@app.get("/health/db")
+def health_db(user=Depends(get_admin_user)):
+    # Engine pool usage: checked-out connections, overflow and checkout wait times
+    stats = pool_stats(engine)
+    if database.read_engine is not None:
+        stats["read"] = pool_stats(database.read_engine)
+    if database.async_engine is not None:
+        stats["async"] = pool_stats(database.async_engine.sync_engine)
+    if database.async_read_engine is not None:
+        stats["async_read"] = pool_stats(database.async_read_engine.sync_engine)
+    return stats
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint(request: Request):
+    if not (settings.metrics_enabled and metrics.AVAILABLE):
+        raise HTTPException(status_code=503, detail="Metrics not available")
+    if settings.metrics_token and not secrets.compare_digest(
+        request.headers.get("authorization", ""), f"Bearer {settings.metrics_token}"
+    ):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(
+        metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE_LATEST}
+    )
+
+
 @app.get("/auth/me")
 def me(user=Depends(get_current_user)):
     return user
@@ -0,0 +1,167 @@
+"""
+Prometheus metrics exposed on /metrics (prometheus-client).
+With several uvicorn workers, set PROMETHEUS_MULTIPROC_DIR to an empty writable
+directory before start: each worker then writes its samples to shared files and
+/metrics aggregates them whichever worker answers.
+If prometheus-client cannot be imported, every helper is a no-op and /metrics
+answers 503.
+"""
+
+import os
+import time
+from typing import Callable, Dict, Optional
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST,
+        CollectorRegistry,
+        Counter,
+        Gauge,
+        Histogram,
+        generate_latest,
+        multiprocess,
+    )
+except ImportError:  # pragma: no cover - optional dependency
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+    Counter = Gauge = Histogram = None
+
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+AVAILABLE = Counter is not None
+
+if AVAILABLE:
+    REQUESTS = Counter(
+        "http_requests_total",
+        "HTTP requests by route template, method and status",
+        ["method", "route", "status"],
+    )
+    REQUEST_LATENCY = Histogram(
+        "http_request_duration_seconds",
+        "HTTP request latency by route template, method and status",
+        ["method", "route", "status"],
+        buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    )
+    IN_FLIGHT = Gauge(
+        "http_requests_in_flight",
+        "HTTP requests being processed",
+        multiprocess_mode="livesum",
+    )
+    DB_POOL_CHECKED_OUT = Gauge(
+        "db_pool_checked_out_connections",
+        "Connections currently checked out of the engine pool",
+        ["pool"],
+        multiprocess_mode="livesum",
+    )
+    DB_POOL_OVERFLOW = Gauge(
+        "db_pool_overflow_connections",
+        "Connections opened beyond pool_size (negative while the pool fills up)",
+        ["pool"],
+        multiprocess_mode="livesum",
+    )
+    DB_POOL_WAIT = Histogram(
+        "db_pool_checkout_wait_seconds",
+        "Time spent waiting for a pooled connection",
+        buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0),
+    )
+    LDAP_LOGIN_LATENCY = Histogram(
+        "ldap_login_duration_seconds",
+        "LDAP bind and profile lookup of a login, by outcome",
+        ["outcome"],
+        buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0),
+    )
+    LOANS = Counter("loan_operations_total", "Loans and returns recorded", ["action"])
+
+
+def observe_checkout(name: str, pool) -> None:
+    if AVAILABLE:
+        DB_POOL_CHECKED_OUT.labels(name).inc()
+        DB_POOL_OVERFLOW.labels(name).set(pool.overflow())
+
+
+def observe_checkin(name: str) -> None:
+    if AVAILABLE:
+        DB_POOL_CHECKED_OUT.labels(name).dec()
+
+
+def observe_pool_wait(seconds: float) -> None:
+    if AVAILABLE:
+        DB_POOL_WAIT.observe(seconds)
+
+
+def observe_ldap_login(outcome: str, seconds: float) -> None:
+    if AVAILABLE:
+        LDAP_LOGIN_LATENCY.labels(outcome).observe(seconds)
+
+
+def count_loan(action: str) -> None:
+    if AVAILABLE:
+        LOANS.labels(action).inc()
+
+
+def render() -> bytes:
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
+
+
+def mark_process_dead() -> None:
+    # Drops the live gauges of this worker from the shared files
+    if AVAILABLE and MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware (no BaseHTTPMiddleware task/stream overhead) recording
+    request count, latency and in-flight requests. The route label is the path
+    template of the matched endpoint, so ids do not create new series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Optional[Dict[Callable, str]] = None
+        # Labelled children per (method, route, status): skips labels() on hot paths
+        self._series: Dict[tuple, tuple] = {}
+
+    def _route_template(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._routes is None:
+            routes: Dict[Callable, str] = {}
+            for route in scope["app"].routes:
+                # Endpoints mounted on two paths (/devices and /devices/) keep the first
+                routes.setdefault(getattr(route, "endpoint", None), route.path)
+            self._routes = routes
+        return self._routes.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not AVAILABLE:
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            IN_FLIGHT.dec()
+            labels = (scope["method"], self._route_template(scope), status)
+            series = self._series.get(labels)
+            if series is None:
+                series = (
+                    REQUESTS.labels(labels[0], labels[1], str(status)),
+                    REQUEST_LATENCY.labels(labels[0], labels[1], str(status)),
+                )
+                self._series[labels] = series
+            series[0].inc()
+            series[1].observe(elapsed)
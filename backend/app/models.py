@@ -5,8 +5,10 @@ from sqlalchemy import (
     String,
     DateTime,
     ForeignKey,
+    Index,
     UniqueConstraint,
     Text,
+    text,
 )
 from sqlalchemy.orm import relationship
 
@@ -42,6 +44,7 @@ class User(Base):
 
 class UserRole(Base):
     __tablename__ = "user_roles"
+    __table_args__ = (UniqueConstraint("user_id", "role_id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(
@@ -73,7 +76,13 @@ class DeviceStatus(Base):
 
 class Device(Base):
     __tablename__ = "devices"
-    __table_args__ = (UniqueConstraint("inventory_number", name="uq_inventory_number"),)
+    __table_args__ = (
+        UniqueConstraint("inventory_number", name="uq_inventory_number"),
+        # Serves the (name, id) keyset pagination of the device listing
+        Index("ix_devices_name_id", "name", "id"),
+        # Type-name search (search.device_search_clause) and the type_id filter
+        Index("ix_devices_type_id", "type_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     inventory_number = Column(String(50), nullable=False)
@@ -85,14 +94,51 @@ class Device(Base):
     security_level = Column(
         String(20), nullable=False, default="standard", server_default="standard"
     )
+    # Open loan of the device, maintained by crud.create_loan/close_loan
+    current_loan_id = Column(
+        Integer,
+        ForeignKey("loans.id", use_alter=True, name="fk_devices_current_loan_id"),
+        nullable=True,
+    )
+    # Incremented by every crud write of the row (loans included); ETag of the detail
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     type = relationship("DeviceType", back_populates="devices")
     status = relationship("DeviceStatus", back_populates="devices")
-    loans = relationship("Loan", back_populates="device", cascade="all, delete-orphan")
+    loans = relationship(
+        "Loan",
+        back_populates="device",
+        foreign_keys="Loan.device_id",
+        cascade="all, delete-orphan",
+    )
+    current_loan = relationship(
+        "Loan", foreign_keys=[current_loan_id], post_update=True
+    )
 
 
 class Loan(Base):
     __tablename__ = "loans"
+    __table_args__ = (
+        # At most one open loan per device, enforced by the database
+        Index(
+            "uq_loans_open_device",
+            "device_id",
+            unique=True,
+            postgresql_where=text("returned_at IS NULL"),
+            sqlite_where=text("returned_at IS NULL"),
+        ),
+        # Keyset pagination of GET /loans, globally and per borrower/device
+        Index("ix_loans_loaned_at_id", "loaned_at", "id"),
+        Index("ix_loans_borrower_loaned_at", "borrower_id", "loaned_at", "id"),
+        Index("ix_loans_device_loaned_at", "device_id", "loaned_at", "id"),
+        # Overdue filter only ever looks at open loans
+        Index(
+            "ix_loans_open_due_date",
+            "due_date",
+            postgresql_where=text("returned_at IS NULL"),
+            sqlite_where=text("returned_at IS NULL"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     device_id = Column(Integer, ForeignKey("devices.id"), nullable=False, index=True)
@@ -103,7 +149,7 @@ class Loan(Base):
     returned_at = Column(DateTime, nullable=True)
     notes = Column(Text, nullable=True)
 
-    device = relationship("Device", back_populates="loans")
+    device = relationship("Device", back_populates="loans", foreign_keys=[device_id])
     borrower = relationship("User", back_populates="loans")
 
     @property
@@ -113,6 +159,29 @@ class Loan(Base):
         return self.borrower.display_name
 
 
+class TableVersion(Base):
+    """Write counter per table, used to invalidate caches across workers."""
+
+    __tablename__ = "table_versions"
+
+    table_name = Column(String(100), primary_key=True)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+class LdapSyncState(Base):
+    """Progress of the directory sync, committed with each page to allow resuming."""
+
+    __tablename__ = "ldap_sync_state"
+
+    name = Column(String(50), primary_key=True)
+    pages_done = Column(Integer, nullable=False, default=0)
+    users_done = Column(Integer, nullable=False, default=0)
+    # Last uid-prefix shard fully imported (ldap_sync.SHARDS), the resume key
+    last_shard = Column(String(16), nullable=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
 class TestUser(Base):
     __tablename__ = "test_users"
 
@@ -1,58 +1,73 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, Request, Response
 
-from .. import crud, schemas, models
-from ..dependencies import get_db, get_user
+from .. import crud, etags, schemas, models
+from ..dependencies import get_executor, get_read_executor, get_user
+from ..executors import Executor
 
 router = APIRouter(prefix="/catalog", tags=["catalog"])
 
 
 @router.get("/types", response_model=list[schemas.DeviceTypeRead])
-def list_types(db: Session = Depends(get_db), user=Depends(get_user)):
-    return crud.list_device_types(db)
+async def list_types(
+    request: Request,
+    response: Response,
+    db: Executor = Depends(get_read_executor),
+    user=Depends(get_user),
+):
+    etag = await db.run(etags.table_etag, models.DeviceType.__tablename__)
+    cached = etags.not_modified(request, etag, etags.CATALOG_CACHE_CONTROL)
+    if cached:
+        return cached
+    etags.set_headers(response, etag, etags.CATALOG_CACHE_CONTROL)
+    return await db.run(crud.list_device_types)
 
 
 @router.post("/types", response_model=schemas.DeviceTypeRead)
-def create_type(
+async def create_type(
     payload: schemas.DeviceTypeCreate,
-    db: Session = Depends(get_db),
+    db: Executor = Depends(get_executor),
     user=Depends(get_user),
 ):
-    return crud.create_device_type(db, payload)
+    return await db.run(crud.create_device_type, payload)
 
 
 @router.get("/statuses", response_model=list[schemas.DeviceStatusRead])
-def list_statuses(db: Session = Depends(get_db), user=Depends(get_user)):
-    return crud.list_statuses(db)
+async def list_statuses(
+    request: Request,
+    response: Response,
+    db: Executor = Depends(get_read_executor),
+    user=Depends(get_user),
+):
+    etag = await db.run(etags.table_etag, models.DeviceStatus.__tablename__)
+    cached = etags.not_modified(request, etag, etags.CATALOG_CACHE_CONTROL)
+    if cached:
+        return cached
+    etags.set_headers(response, etag, etags.CATALOG_CACHE_CONTROL)
+    return await db.run(crud.list_statuses)
 
 
 @router.post("/statuses", response_model=schemas.DeviceStatusRead)
-def create_status(
+async def create_status(
     payload: schemas.DeviceStatusCreate,
-    db: Session = Depends(get_db),
+    db: Executor = Depends(get_executor),
     user=Depends(get_user),
 ):
-    return crud.create_status(db, payload)
+    return await db.run(crud.create_status, payload)
+
+
+def test_user_read(u: models.TestUser) -> schemas.UserRead:
+    # Accept legacy string values just in case.
+    if isinstance(u.roles, str):
+        roles = [part.strip() for part in u.roles.split(",") if part.strip()]
+    else:
+        roles = u.roles_list
+    return schemas.UserRead(
+        id=u.id, username=u.username, display_name=u.display_name, roles=roles
+    )
 
 
 @router.get("/users", response_model=list[schemas.UserRead])
-def list_users(db: Session = Depends(get_db), user=Depends(get_user)):
+async def list_users(db: Executor = Depends(get_read_executor), user=Depends(get_user)):
     # Only intended for dev/test; returns seeded test users with roles list.
-    test_users = db.scalars(select(models.TestUser)).all()
-
-    def _roles(u: models.TestUser):
-        # Accept legacy string values just in case.
-        if isinstance(u.roles, str):
-            return [part.strip() for part in u.roles.split(",") if part.strip()]
-        return u.roles_list
-
-    return [
-        schemas.UserRead(
-            id=u.id,
-            username=u.username,
-            display_name=u.display_name,
-            roles=_roles(u),
-        )
-        for u in test_users
-    ]
+    test_users = await db.run(crud.list_test_users)
+    return [test_user_read(u) for u in test_users]
@@ -1,31 +1,99 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 
-from .. import crud, schemas
-from ..dependencies import get_db, get_user
+from .. import crud, etags, export, schemas
+from ..dependencies import get_executor, get_read_executor, get_user
+from ..executors import Executor
+from ..responses import FastJSONResponse
 
 router = APIRouter(prefix="/devices", tags=["devices"])
 
 
 @router.get("/", response_model=schemas.PagedResult)
 @router.get(
-    "", include_in_schema=False
+    "", response_model=schemas.PagedResult, include_in_schema=False
 )  # allow /devices without trailing slash (avoid 307 redirect)
-def list_devices(
+async def list_devices(
     search: str | None = Query(
         default=None, description="Recherche par nom, numéro ou type"
     ),
     status_id: int | None = None,
     type_id: int | None = None,
     skip: int = 0,
-    limit: int = 50,
-    db: Session = Depends(get_db),
+    limit: int = Query(default=50, ge=1),
+    cursor: str | None = Query(
+        default=None, description="Jeton next_cursor de la page précédente"
+    ),
+    total_mode: schemas.TotalMode = Query(
+        default=schemas.TotalMode.exact,
+        description="Calcul du total : exact, estimated, cached ou none",
+    ),
+    fields: str | None = Query(
+        default=None,
+        description="Champs DeviceRead à renvoyer, séparés par des virgules (ex. id,inventory_number,name,status)",
+    ),
+    db: Executor = Depends(get_read_executor),
     user=Depends(get_user),
 ):
-    total, items = crud.list_devices(
-        db, search=search, status_id=status_id, type_id=type_id, skip=skip, limit=limit
+    try:
+        total, total_mode, items, next_cursor = await db.run(
+            crud.list_device_rows,
+            search=search,
+            status_id=status_id,
+            type_id=type_id,
+            skip=skip,
+            limit=limit,
+            cursor=cursor,
+            total_mode=total_mode,
+            fields=fields,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    # Rows are already shaped like DeviceRead: no response-model pass
+    return FastJSONResponse(
+        {
+            "total": total,
+            "total_mode": total_mode,
+            "items": items,
+            "next_cursor": next_cursor,
+        }
+    )
+
+
+@router.get("/export")
+async def export_devices(
+    search: str | None = Query(
+        default=None, description="Recherche par nom, numéro ou type"
+    ),
+    status_id: int | None = None,
+    type_id: int | None = None,
+    fields: str | None = Query(
+        default=None,
+        description="Champs DeviceRead à exporter, séparés par des virgules",
+    ),
+    export_format: schemas.ExportFormat = Query(
+        default=schemas.ExportFormat.csv, alias="format", description="csv ou ndjson"
+    ),
+    db: Executor = Depends(get_read_executor),
+    user=Depends(get_user),
+):
+    # Toute la liste filtrée, lue par un curseur serveur : mémoire constante
+    try:
+        fields, stmt, layout = crud.device_export_query(
+            db.dialect_name,
+            search=search,
+            status_id=status_id,
+            type_id=type_id,
+            fields=fields,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return export.streaming_response(
+        db.stream(stmt, layout),
+        export_format,
+        schemas.DeviceRead,
+        fields,
+        "devices",
     )
-    return {"total": total, "items": items}
 
 
 @router.post(
@@ -34,42 +102,56 @@ def list_devices(
 @router.post(
     "", response_model=schemas.DeviceRead, status_code=status.HTTP_201_CREATED, include_in_schema=False
 )
-def create_device(
-    device: schemas.DeviceCreate, db: Session = Depends(get_db), user=Depends(get_user)
+async def create_device(
+    device: schemas.DeviceCreate,
+    db: Executor = Depends(get_executor),
+    user=Depends(get_user),
 ):
-    existing = crud.get_device_by_inventory(db, device.inventory_number)
+    existing = await db.run(crud.get_device_by_inventory, device.inventory_number)
     if existing:
         raise HTTPException(status_code=400, detail="Inventory number already exists")
-    return crud.create_device(db, device)
+    return await db.run(crud.create_device, device)
 
 
 @router.get("/{device_id}", response_model=schemas.DeviceRead)
-def get_device(device_id: int, db: Session = Depends(get_db), user=Depends(get_user)):
-    device = crud.get_device(db, device_id)
+async def get_device(
+    device_id: int,
+    request: Request,
+    response: Response,
+    db: Executor = Depends(get_read_executor),
+    user=Depends(get_user),
+):
+    etag = await db.run(etags.device_etag, device_id)
+    cached = etag and etags.not_modified(request, etag, etags.DEVICE_CACHE_CONTROL)
+    if cached:
+        return cached
+    device = await db.run(crud.get_device, device_id)
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
+    if etag:
+        etags.set_headers(response, etag, etags.DEVICE_CACHE_CONTROL)
     return device
 
 
 @router.put("/{device_id}", response_model=schemas.DeviceRead)
-def update_device(
+async def update_device(
     device_id: int,
     payload: schemas.DeviceUpdate,
-    db: Session = Depends(get_db),
+    db: Executor = Depends(get_executor),
     user=Depends(get_user),
 ):
-    device = crud.get_device(db, device_id)
+    device = await db.run(crud.get_device, device_id)
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
-    return crud.update_device(db, device, payload)
+    return await db.run(crud.update_device, device, payload)
 
 
 @router.delete("/{device_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_device(
-    device_id: int, db: Session = Depends(get_db), user=Depends(get_user)
+async def delete_device(
+    device_id: int, db: Executor = Depends(get_executor), user=Depends(get_user)
 ):
-    device = crud.get_device(db, device_id)
+    device = await db.run(crud.get_device, device_id)
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
-    crud.delete_device(db, device)
+    await db.run(crud.delete_device, device)
     return None
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select
-from sqlalchemy.orm import Session, selectinload, load_only
+from datetime import datetime
 
-from .. import crud, schemas, models
-from ..dependencies import get_db, get_user
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from .. import cache, crud, export, schemas
+from ..dependencies import get_executor, get_read_executor, get_user
+from ..executors import Executor
+from ..responses import FastJSONResponse
 
 router = APIRouter(prefix="/loans", tags=["loans"])
 
@@ -12,8 +14,8 @@ STATUS_LOANED = "loaned"
 STATUS_MAINTENANCE = "maintenance"
 
 
-def _get_status(db: Session, name: str):
-    status = crud.get_status_by_name(db, name)
+async def _get_status(db: Executor, name: str):
+    status = await db.run(cache.statuses.get, name)
     if not status:
         raise HTTPException(
             status_code=500, detail=f"Status '{name}' not found. Run init_db."
@@ -21,72 +23,157 @@ def _get_status(db: Session, name: str):
     return status
 
 
-@router.get("/", response_model=list[schemas.LoanRead])
-def list_loans(db: Session = Depends(get_db), user=Depends(get_user)):
-    stmt = (
-        select(models.Loan)
-        .options(
-            selectinload(models.Loan.borrower).load_only(
-                models.User.first_name, models.User.last_name, models.User.username
-            )
+@router.get("/", response_model=schemas.LoanPagedResult)
+async def list_loans(
+    state: schemas.LoanState | None = Query(
+        default=None, description="Prêts en cours (open) ou rendus (returned)"
+    ),
+    borrower_id: int | None = None,
+    device_id: int | None = None,
+    loaned_from: datetime | None = None,
+    loaned_to: datetime | None = None,
+    overdue: bool = Query(
+        default=False,
+        description="Uniquement les prêts en cours dont l'échéance est passée",
+    ),
+    limit: int = Query(default=50, ge=1, le=500),
+    cursor: str | None = Query(
+        default=None, description="Jeton next_cursor de la page précédente"
+    ),
+    fields: str | None = Query(
+        default=None,
+        description="Champs LoanRead à renvoyer, séparés par des virgules (ex. id,device_id,loaned_at)",
+    ),
+    db: Executor = Depends(get_read_executor),
+    user=Depends(get_user),
+):
+    try:
+        items, next_cursor = await db.run(
+            crud.list_loan_rows,
+            state=state,
+            borrower_id=borrower_id,
+            device_id=device_id,
+            loaned_from=loaned_from,
+            loaned_to=loaned_to,
+            overdue=overdue,
+            limit=limit,
+            cursor=cursor,
+            fields=fields,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    # Rows are already shaped like LoanRead: no response-model pass
+    return FastJSONResponse({"items": items, "next_cursor": next_cursor})
+
+
+@router.get("/export")
+async def export_loans(
+    state: schemas.LoanState | None = Query(
+        default=None, description="Prêts en cours (open) ou rendus (returned)"
+    ),
+    borrower_id: int | None = None,
+    device_id: int | None = None,
+    loaned_from: datetime | None = None,
+    loaned_to: datetime | None = None,
+    overdue: bool = Query(
+        default=False,
+        description="Uniquement les prêts en cours dont l'échéance est passée",
+    ),
+    fields: str | None = Query(
+        default=None,
+        description="Champs LoanRead à exporter, séparés par des virgules",
+    ),
+    export_format: schemas.ExportFormat = Query(
+        default=schemas.ExportFormat.csv, alias="format", description="csv ou ndjson"
+    ),
+    db: Executor = Depends(get_read_executor),
+    user=Depends(get_user),
+):
+    # Toute la liste filtrée, lue par un curseur serveur : mémoire constante
+    try:
+        fields, stmt, layout = crud.loan_export_query(
+            state=state,
+            borrower_id=borrower_id,
+            device_id=device_id,
+            loaned_from=loaned_from,
+            loaned_to=loaned_to,
+            overdue=overdue,
+            fields=fields,
         )
-        .order_by(models.Loan.loaned_at.desc())
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return export.streaming_response(
+        db.stream(stmt, layout),
+        export_format,
+        schemas.LoanRead,
+        fields,
+        "loans",
     )
-    return db.scalars(stmt).all()
 
 
 @router.post("/loan", response_model=schemas.LoanRead)
-def loan_device(
-    payload: schemas.LoanCreate, db: Session = Depends(get_db), user=Depends(get_user)
+async def loan_device(
+    payload: schemas.LoanCreate,
+    db: Executor = Depends(get_executor),
+    user=Depends(get_user),
 ):
-    status_loaned = _get_status(db, STATUS_LOANED)
-    status_maintenance = _get_status(db, STATUS_MAINTENANCE)
+    status_loaned = await _get_status(db, STATUS_LOANED)
+    status_maintenance = await _get_status(db, STATUS_MAINTENANCE)
     try:
-        return crud.create_loan(
-            db,
+        return await db.run(
+            crud.create_loan,
             payload,
             status_loaned=status_loaned,
             status_maintenance=status_maintenance,
             user_roles=user.get("roles", []),
         )
+    except crud.LoanConflictError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc))
 
 
 @router.post("/return", response_model=schemas.LoanRead)
-def return_device(
-    payload: schemas.LoanReturn, db: Session = Depends(get_db), user=Depends(get_user)
+async def return_device(
+    payload: schemas.LoanReturn,
+    db: Executor = Depends(get_executor),
+    user=Depends(get_user),
 ):
-    status_available = _get_status(db, STATUS_AVAILABLE)
-    status_maintenance = _get_status(db, STATUS_MAINTENANCE)
+    status_available = await _get_status(db, STATUS_AVAILABLE)
+    status_maintenance = await _get_status(db, STATUS_MAINTENANCE)
     try:
-        return crud.close_loan(
-            db,
+        return await db.run(
+            crud.close_loan,
             payload,
             status_available=status_available,
             status_maintenance=status_maintenance,
             user_roles=user.get("roles", []),
         )
+    except crud.LoanConflictError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc))
 
 
 @router.post("/scan", response_model=schemas.ScanDecision)
-def scan_inventory_number(
-    payload: schemas.ScanRequest, db: Session = Depends(get_db), user=Depends(get_user)
+async def scan_inventory_number(
+    payload: schemas.ScanRequest,
+    db: Executor = Depends(get_executor),
+    user=Depends(get_user),
 ):
-    device = crud.get_device_by_inventory(db, payload.inventory_number)
+    device = await db.run(crud.get_device_by_inventory, payload.inventory_number)
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
-    status_available = _get_status(db, STATUS_AVAILABLE)
+    status_available = await _get_status(db, STATUS_AVAILABLE)
     try:
         crud._check_security(device, user.get("roles", []))
     except ValueError as exc:
         raise HTTPException(status_code=403, detail=str(exc))
     action = "loan" if device.status_id == status_available.id else "return"
+    current_status = await db.run(cache.statuses.get_by_id, device.status_id)
     return schemas.ScanDecision(
         device_id=device.id,
         inventory_number=device.inventory_number,
         action=action,
-        status=device.status.name,
+        status=current_status.name,
     )
@@ -1,9 +1,10 @@
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from sqlalchemy.orm import Session
 
-from .. import crud, schemas
-from ..dependencies import get_db, get_user
+from .. import crud, etags, models, schemas
+from ..dependencies import get_db, get_read_db, get_user
+from ..responses import FastJSONResponse
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -35,17 +36,28 @@ def list_users(db: Session = Depends(get_db), user=Depends(get_user)):
 
 
 @router.get("/options", response_model=List[schemas.UserRead])
-def list_users_for_loans(db: Session = Depends(get_db), user=Depends(get_user)):
+def list_users_for_loans(
+    request: Request, db: Session = Depends(get_read_db), user=Depends(get_user)
+):
     # Accessible aux utilisateurs authentifiés : retourne la liste des utilisateurs connus (LDAP provisionnés)
-    records = crud.list_users_with_roles(db)
-    return [
-        schemas.UserRead(
-            username=u.username,
-            display_name=u.display_name,
-            roles=[r.name for r in u.roles],
-        )
-        for u in records
-    ]
+    etag = etags.table_etag(db, models.User.__tablename__, models.Role.__tablename__)
+    cached = etags.not_modified(request, etag, etags.USERS_CACHE_CONTROL)
+    if cached:
+        return cached
+    response = FastJSONResponse(crud.list_user_option_rows(db))
+    etags.set_headers(response, etag, etags.USERS_CACHE_CONTROL)
+    return response
+
+
+@router.get("/search", response_model=List[schemas.UserOption])
+def search_users(
+    q: str = Query(..., min_length=1, description="Début du nom d'utilisateur ou nom"),
+    limit: int = Query(default=10, ge=1, le=50),
+    db: Session = Depends(get_read_db),
+    user=Depends(get_user),
+):
+    # Type-ahead du formulaire de prêt : uniquement les champs utiles, classés
+    return crud.search_users(db, q.strip(), limit=limit)
 
 
 @router.put("/{username}", response_model=schemas.UserRoleRead)
@@ -146,6 +146,16 @@ class LoanRead(BaseModel):
         orm_mode = True
 
 
+class LoanState(str, Enum):
+    open = "open"
+    returned = "returned"
+
+
+class LoanPagedResult(BaseModel):
+    items: List[LoanRead]
+    next_cursor: Optional[str] = None
+
+
 class ScanDecision(BaseModel):
     device_id: int
     inventory_number: str
@@ -157,9 +167,23 @@ class ScanRequest(BaseModel):
     inventory_number: str
 
 
+class TotalMode(str, Enum):
+    exact = "exact"
+    estimated = "estimated"
+    cached = "cached"
+    none = "none"
+
+
+class ExportFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+
 class PagedResult(BaseModel):
-    total: int
+    total: Optional[int] = None
+    total_mode: TotalMode = TotalMode.exact
     items: List[DeviceRead]
+    next_cursor: Optional[str] = None
 
 
 class UserRead(BaseModel):
@@ -171,6 +195,15 @@ class UserRead(BaseModel):
         orm_mode = True
 
 
+class UserOption(BaseModel):
+    id: int
+    username: str
+    display_name: Optional[str] = None
+
+    class Config:
+        orm_mode = True
+
+
 class UserRoleRead(BaseModel):
     username: str
     email: Optional[str] = None
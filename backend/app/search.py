@@ -0,0 +1,124 @@
+from typing import Optional, Tuple
+from sqlalchemy import any_, case, func, literal_column, or_, select, text
+from sqlalchemy.engine import Connection
+
+from . import models
+
+# Config used both by the generated column and by the queries (must match)
+TS_CONFIG = "simple"
+
+SEARCH_DOCUMENT_SQL = (
+    f"to_tsvector('{TS_CONFIG}', "
+    "coalesce(name, '') || ' ' || coalesce(inventory_number, '') || ' ' "
+    "|| coalesce(description, ''))"
+)
+
+# Indexed by ix_users_full_name_trgm; the query form must stay the same expression
+USER_FULL_NAME_SQL = "coalesce(first_name, '') || ' ' || coalesce(last_name, '')"
+USER_FULL_NAME_QUERY_SQL = (
+    "(coalesce(users.first_name, '') || ' ' || coalesce(users.last_name, ''))"
+)
+
+# Kept in sync with alembic/versions/0005_devices_search.py (dev schema helper)
+SEARCH_SCHEMA_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "ALTER TABLE devices ADD COLUMN IF NOT EXISTS search_document tsvector "
+    f"GENERATED ALWAYS AS ({SEARCH_DOCUMENT_SQL}) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_devices_search_document "
+    "ON devices USING gin (search_document)",
+    "CREATE INDEX IF NOT EXISTS ix_devices_inventory_number_trgm "
+    "ON devices USING gin (inventory_number gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_devices_name_trgm "
+    "ON devices USING gin (name gin_trgm_ops)",
+    # Kept in sync with alembic/versions/0012_devices_type_id_index.py
+    "CREATE INDEX IF NOT EXISTS ix_devices_type_id ON devices (type_id)",
+    # Kept in sync with alembic/versions/0011_users_search.py
+    "CREATE INDEX IF NOT EXISTS ix_users_username_prefix "
+    "ON users (lower(username) text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+    "ON users USING gin (username gin_trgm_ops)",
+    f"CREATE INDEX IF NOT EXISTS ix_users_full_name_trgm "
+    f"ON users USING gin (({USER_FULL_NAME_SQL}) gin_trgm_ops)",
+]
+
+
+def ensure_search_schema(conn: Connection) -> None:
+    """Create the search column/indexes outside Alembic (dev only, Postgres only)."""
+    if conn.dialect.name != "postgresql":
+        return
+    for statement in SEARCH_SCHEMA_DDL:
+        conn.execute(text(statement))
+
+
+def is_ranked(dialect_name: str) -> bool:
+    return dialect_name == "postgresql"
+
+
+def _matching_type_ids(like: str):
+    return select(models.DeviceType.id).where(models.DeviceType.name.ilike(like))
+
+
+def device_search_clause(
+    dialect_name: str, term: str
+) -> Tuple[object, Optional[object]]:
+    """
+    Return (where clause, rank expression) for a device search.
+    Every predicate is on devices only (the type name is matched through type_id),
+    so that Postgres can combine the indexes with a BitmapOr.
+    Rank is None on the ILIKE fallback.
+    """
+    like = f"%{term}%"
+    if not is_ranked(dialect_name):
+        # SQLite/tests: plain substring match, no index, no ranking
+        return (
+            or_(
+                models.Device.name.ilike(like),
+                models.Device.inventory_number.ilike(like),
+                models.Device.description.ilike(like),
+                models.Device.type_id.in_(_matching_type_ids(like)),
+            ),
+            None,
+        )
+
+    document = literal_column("devices.search_document")
+    query = func.websearch_to_tsquery(literal_column(f"'{TS_CONFIG}'::regconfig"), term)
+    inventory_similarity = func.similarity(models.Device.inventory_number, term)
+    where = or_(
+        document.op("@@")(query),
+        # ILIKE on name/inventory_number is served by the gin_trgm_ops indexes
+        models.Device.inventory_number.ilike(like),
+        models.Device.name.ilike(like),
+        # Fuzzy inventory number (pg_trgm.similarity_threshold, 0.3 by default)
+        models.Device.inventory_number.op("%")(term),
+        # ARRAY(subquery) is an InitPlan run once: type_id = ANY(...) stays an
+        # ix_devices_type_id index condition (IN (subquery) would be a filter)
+        models.Device.type_id
+        == any_(func.array(_matching_type_ids(like).scalar_subquery())),
+    )
+    rank = func.ts_rank_cd(document, query) + inventory_similarity
+    return where, rank
+
+
+def user_search_clause(dialect_name: str, term: str) -> Tuple[object, list]:
+    """Return (where clause, order by) for the borrower type-ahead."""
+    user = models.User
+    prefix_match = func.lower(user.username).like(f"{term.lower()}%")
+    like = f"%{term}%"
+    full_name = literal_column(USER_FULL_NAME_QUERY_SQL)
+    prefix_first = case((prefix_match, 0), else_=1)
+    if not is_ranked(dialect_name):
+        where = or_(prefix_match, user.username.ilike(like), full_name.ilike(like))
+        return where, [prefix_first, user.username.asc()]
+
+    where = or_(
+        prefix_match,
+        user.username.ilike(like),
+        full_name.ilike(like),
+        # Fuzzy matches (pg_trgm.similarity_threshold)
+        user.username.op("%")(term),
+        full_name.op("%")(term),
+    )
+    similarity = func.greatest(
+        func.similarity(user.username, term), func.similarity(full_name, term)
+    )
+    return where, [prefix_first, similarity.desc(), user.username.asc()]
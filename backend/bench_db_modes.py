@@ -0,0 +1,123 @@
+"""
+Benchmark des deux modes d'accès à la base : Session dans le threadpool AnyIO vs
+AsyncSession/asyncpg (DB_ASYNC=true), mêmes routes, à nombre de workers égal.
+Lance uvicorn pour chaque mode, envoie des requêtes concurrentes sur /devices, /loans
+et /catalog puis affiche requêtes/s et latences p50/p99.
+Usage :
+    poetry run python bench_db_modes.py [--workers 2] [--concurrency 64] [--duration 20]
+Nécessite httpx et asyncpg, et AUTH_DISABLED=true (ou --token <jwt>).
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+PATHS = ["/devices?limit=50", "/loans/?limit=50", "/catalog/types", "/catalog/statuses"]
+
+
+def _percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _start_server(db_async: bool, port: int, workers: int) -> subprocess.Popen:
+    env = dict(os.environ, DB_ASYNC="true" if db_async else "false")
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+    )
+
+
+async def _wait_ready(base_url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Serveur non disponible sur {base_url}")
+
+
+async def _load(base_url: str, headers: dict, concurrency: int, duration: float):
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async def worker(client: httpx.AsyncClient, offset: int):
+        nonlocal errors
+        i = offset
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            response = await client.get(PATHS[i % len(PATHS)])
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+            i += 1
+
+    async with httpx.AsyncClient(
+        base_url=base_url, headers=headers, limits=limits, timeout=30.0
+    ) as client:
+        started = time.monotonic()
+        await asyncio.gather(*(worker(client, n) for n in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return latencies, errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--token", help="JWT si l'authentification est active")
+    args = parser.parse_args()
+
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    base_url = f"http://127.0.0.1:{args.port}"
+    print(
+        f"{args.workers} worker(s), {args.concurrency} requêtes concurrentes, "
+        f"{args.duration:.0f} s par mode"
+    )
+    for label, db_async in [("sync", False), ("async", True)]:
+        server = _start_server(db_async, args.port, args.workers)
+        try:
+            asyncio.run(_wait_ready(base_url))
+            # Warm-up: connection pools, lookup caches
+            asyncio.run(_load(base_url, headers, args.concurrency, 2.0))
+            latencies, errors, elapsed = asyncio.run(
+                _load(base_url, headers, args.concurrency, args.duration)
+            )
+        finally:
+            server.terminate()
+            server.wait()
+        print(
+            f"{label:<6} {len(latencies) / elapsed:8.1f} req/s  "
+            f"p50 {_percentile(latencies, 50) * 1000:7.1f} ms  "
+            f"p99 {_percentile(latencies, 99) * 1000:7.1f} ms  "
+            f"erreurs {errors}"
+        )
+
+
+if __name__ == "__main__":
+    main()
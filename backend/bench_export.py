@@ -0,0 +1,128 @@
+"""
+Mémoire de l'export /devices/export : remplit une base SQLite temporaire avec N appareils
+(un prêt en cours sur un sur deux) puis exporte tout en CSV ou NDJSON par le même flux que
+l'endpoint (curseur serveur + encodage par lots). Échoue si le RSS maximal augmente de
+plus que le budget pendant l'export, quelle que soit la taille de la table.
+Usage :
+    poetry run python bench_export.py [--rows 1000000] [--format csv] [--budget-mb 64]
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, update
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, export, models, schemas
+from app.database import Base
+
+
+def _rss_mb() -> float:
+    # RSS courant (Linux) ; le maximum du processus inclurait le remplissage de la base
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize() / 2**20
+
+
+def _seed(engine, rows: int, batch: int = 20000) -> None:
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(models.DeviceType).values(name="Oscilloscope"))
+        conn.execute(insert(models.DeviceStatus).values(name="loaned"))
+        conn.execute(insert(models.User).values(username="user", last_name="Nom"))
+        for start in range(0, rows, batch):
+            stop = min(start + batch, rows)
+            conn.execute(
+                insert(models.Device),
+                [
+                    {
+                        "id": i + 1,
+                        "inventory_number": f"INV-{i:07d}",
+                        "name": f"Appareil {i}",
+                        "description": "Description de l'appareil " * 3,
+                        "location": "B21",
+                        "type_id": 1,
+                        "status_id": 1,
+                        "security_level": schemas.SecurityLevel.standard,
+                    }
+                    for i in range(start, stop)
+                ],
+            )
+            loaned = range(start, stop, 2)
+            conn.execute(
+                insert(models.Loan),
+                [
+                    {
+                        "id": i + 1,
+                        "device_id": i + 1,
+                        "borrower_id": 1,
+                        "loaned_at": now - timedelta(minutes=i),
+                    }
+                    for i in loaned
+                ],
+            )
+        conn.execute(
+            update(models.Device)
+            .where(models.Device.id % 2 == 1)
+            .values(current_loan_id=models.Device.id)
+        )
+
+
+async def _drain(response):
+    """Taille du corps et RSS maximal observé pendant l'export."""
+    size = 0
+    peak = _rss_mb()
+    async for chunk in response.body_iterator:
+        size += len(chunk)
+        peak = max(peak, _rss_mb())
+    return size, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--budget-mb", type=float, default=64.0)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'export.db')}")
+        Base.metadata.create_all(engine)
+        started = time.perf_counter()
+        _seed(engine, args.rows)
+        print(f"{args.rows} appareils créés en {time.perf_counter() - started:.1f} s")
+
+        Session = sessionmaker(bind=engine)
+        with Session() as db:
+            baseline = _rss_mb()
+            started = time.perf_counter()
+            fields, stmt, layout = crud.device_export_query(engine.dialect.name)
+            response = export.streaming_response(
+                crud.stream_rows(db, stmt, layout, batch_size=args.batch_size),
+                schemas.ExportFormat(args.format),
+                schemas.DeviceRead,
+                fields,
+                "devices",
+            )
+            size, peak = asyncio.run(_drain(response))
+            elapsed = time.perf_counter() - started
+        growth = peak - baseline
+        engine.dispose()
+
+    print(
+        f"Export {args.format} : {size / 1e6:.1f} Mo en {elapsed:.1f} s "
+        f"({args.rows / elapsed:,.0f} lignes/s)"
+    )
+    print(f"RSS max : +{growth:.1f} Mo (budget {args.budget_mb:.0f} Mo)")
+    if growth > args.budget_mb:
+        sys.exit("Budget mémoire dépassé")
+
+
+if __name__ == "__main__":
+    main()
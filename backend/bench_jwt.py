@@ -0,0 +1,48 @@
+"""
+Micro-benchmark du décodage JWT de get_current_user : vérification complète à chaque
+requête vs cache des jetons déjà vérifiés.
+Usage :
+    poetry run python bench_jwt.py [iterations]
+"""
+
+import sys
+import time
+
+from app import auth, cache
+from app.config import get_settings
+
+
+def _measure(label: str, func, iterations: int) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    per_call = (time.process_time() - start) / iterations
+    print(f"{label:<28} {per_call * 1e6:8.2f} µs CPU / requête")
+    return per_call
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    settings = get_settings()
+    token = auth.create_access_token(
+        {"sub": "bench.user", "roles": ["employee"]}, settings
+    )
+
+    for backend in ("jose", "pyjwt"):
+        settings.jwt_backend = backend
+        uncached = _measure(
+            f"{backend} sans cache",
+            lambda: auth._decode_with_backend(token, settings),
+            iterations,
+        )
+        cache.tokens.clear()
+        cached = _measure(
+            f"{backend} avec cache",
+            lambda: auth.decode_access_token(token, settings),
+            iterations,
+        )
+        print(f"  -> économie {(uncached - cached) * 1e6:.2f} µs CPU / requête")
+
+
+if __name__ == "__main__":
+    main()
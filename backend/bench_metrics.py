@@ -0,0 +1,86 @@
+"""
+Coût par requête du middleware Prometheus : enregistrement seul (compteur, histogramme,
+requêtes en cours) puis requête complète sur /health avec et sans middleware.
+Usage :
+    poetry run python bench_metrics.py [iterations]
+Avec PROMETHEUS_MULTIPROC_DIR défini, mesure le mode multiprocess (fichiers partagés).
+"""
+
+import asyncio
+import sys
+import time
+
+from fastapi import FastAPI
+
+from app import metrics
+
+
+def _app(with_metrics: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    if with_metrics:
+        app.add_middleware(metrics.MetricsMiddleware)
+    return app
+
+
+async def _call(app, iterations: int) -> float:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/health",
+        "raw_path": b"/health",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("127.0.0.1", 1234),
+        "server": ("127.0.0.1", 8000),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    if not metrics.AVAILABLE:
+        sys.exit("prometheus-client n'est pas installé")
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    mode = "multiprocess" if metrics.MULTIPROCESS else "processus unique"
+    print(f"Mode {mode}, {iterations} itérations")
+
+    labels = ("GET", "/health", "200")
+    start = time.perf_counter()
+    for _ in range(iterations):
+        metrics.IN_FLIGHT.inc()
+        metrics.IN_FLIGHT.dec()
+        metrics.REQUESTS.labels(*labels).inc()
+        metrics.REQUEST_LATENCY.labels(*labels).observe(0.01)
+    record = (time.perf_counter() - start) / iterations
+    print(f"{'enregistrement seul':<28} {record * 1e6:8.2f} µs / requête")
+
+    without = asyncio.run(_call(_app(False), iterations))
+    with_metrics = asyncio.run(_call(_app(True), iterations))
+    print(f"{'/health sans middleware':<28} {without * 1e6:8.2f} µs / requête")
+    print(f"{'/health avec middleware':<28} {with_metrics * 1e6:8.2f} µs / requête")
+    print(
+        f"  -> surcoût {(with_metrics - without) * 1e6:.2f} µs "
+        f"({(with_metrics - without) / without:.1%})"
+    )
+
+
+if __name__ == "__main__":
+    main()
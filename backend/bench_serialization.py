@@ -0,0 +1,187 @@
+"""
+Coût CPU par élément des listes /devices, /loans et /users/options : chemin ORM +
+validation response_model (avant) vs lignes SQL + FastJSONResponse (après).
+Les données sont générées dans une base SQLite en mémoire.
+Usage :
+    poetry run python bench_serialization.py [taille_page] [répétitions]
+"""
+
+import sys
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import aliased, contains_eager, selectinload, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app import crud, models, schemas
+from app.database import Base
+from app.responses import FastJSONResponse
+
+
+def _seed(db, devices: int) -> None:
+    db.add_all(
+        [models.DeviceType(name="Oscilloscope"), models.DeviceStatus(name="loaned")]
+    )
+    roles = [models.Role(name=name) for name in ("employee", "expert")]
+    db.add_all(roles)
+    users = [
+        models.User(
+            username=f"user{i}",
+            first_name="Prénom",
+            last_name=f"Nom {i}",
+            roles=roles[: 1 + i % 2],
+        )
+        for i in range(devices)
+    ]
+    db.add_all(users)
+    db.flush()
+    now = datetime.utcnow()
+    for i in range(devices):
+        device = models.Device(
+            inventory_number=f"INV-{i:05d}",
+            name=f"Appareil {i}",
+            description="Description de l'appareil " * 3,
+            location="B21",
+            type_id=1,
+            status_id=1,
+        )
+        loan = models.Loan(
+            device=device,
+            borrower=users[i],
+            usage_location="Labo",
+            loaned_at=now - timedelta(days=i),
+            due_date=now + timedelta(days=7),
+        )
+        device.current_loan = loan
+        db.add_all([device, loan])
+    db.commit()
+
+
+def _orm_devices(db, limit: int):
+    """Ancien chemin ORM de GET /devices (première page, total exact)."""
+    stmt, rank, total, mode = crud._device_listing(
+        db, select(models.Device), None, None, None, schemas.TotalMode.exact
+    )
+    stmt, _ = crud._device_page(stmt, rank, 0, limit, None)
+    open_loan = aliased(models.Loan)
+    borrower = aliased(models.User)
+    stmt = (
+        stmt.outerjoin(models.Device.current_loan.of_type(open_loan))
+        .outerjoin(open_loan.borrower.of_type(borrower))
+        .options(
+            contains_eager(models.Device.type),
+            contains_eager(models.Device.status),
+            contains_eager(models.Device.current_loan.of_type(open_loan))
+            .contains_eager(open_loan.borrower.of_type(borrower))
+            .load_only(borrower.first_name, borrower.last_name, borrower.username),
+        )
+    )
+    items = db.scalars(stmt).all()
+    cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        cursor = crud._encode_cursor(items[-1].name, items[-1].id)
+    return total, mode, items, cursor
+
+
+def _orm_loans(db, limit: int):
+    """Ancien chemin ORM de GET /loans (première page)."""
+    stmt = select(models.Loan).options(
+        selectinload(models.Loan.borrower).load_only(
+            models.User.first_name, models.User.last_name, models.User.username
+        )
+    )
+    stmt = crud._loan_listing(stmt, None, None, None, None, None, False, limit, None)
+    items = db.scalars(stmt).all()
+    cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        cursor = crud._encode_cursor(items[-1].loaned_at.isoformat(), items[-1].id)
+    return items, cursor
+
+
+def _measure(label: str, func, items: int, repeat: int) -> float:
+    func()  # warm-up (statement compilation cache)
+    start = time.process_time()
+    for _ in range(repeat):
+        func()
+    per_item = (time.process_time() - start) / repeat / items
+    print(f"{label:<42} {per_item * 1e6:8.2f} µs CPU / élément")
+    return per_item
+
+
+def main():
+    page = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, autoflush=False)
+    with Session() as db:
+        _seed(db, page)
+
+    def devices_before():
+        with Session() as db:
+            total, mode, items, cursor = _orm_devices(db, page)
+            model = schemas.PagedResult(
+                total=total, total_mode=mode, items=items, next_cursor=cursor
+            )
+            return JSONResponse(jsonable_encoder(model)).body
+
+    def devices_after():
+        with Session() as db:
+            total, mode, items, cursor = crud.list_device_rows(db, limit=page)
+            return FastJSONResponse(
+                {
+                    "total": total,
+                    "total_mode": mode,
+                    "items": items,
+                    "next_cursor": cursor,
+                }
+            ).body
+
+    def loans_before():
+        with Session() as db:
+            items, cursor = _orm_loans(db, page)
+            model = schemas.LoanPagedResult(items=items, next_cursor=cursor)
+            return JSONResponse(jsonable_encoder(model)).body
+
+    def loans_after():
+        with Session() as db:
+            items, cursor = crud.list_loan_rows(db, limit=page)
+            return FastJSONResponse({"items": items, "next_cursor": cursor}).body
+
+    def users_before():
+        with Session() as db:
+            users = [
+                schemas.UserRead(
+                    username=u.username,
+                    display_name=u.display_name,
+                    roles=[r.name for r in u.roles],
+                )
+                for u in crud.list_users_with_roles(db)
+            ]
+            return JSONResponse(jsonable_encoder(users)).body
+
+    def users_after():
+        with Session() as db:
+            return FastJSONResponse(crud.list_user_option_rows(db)).body
+
+    assert len(devices_before()) and devices_after()
+    print(f"Pages de {page} éléments, {repeat} répétitions (requête SQL comprise)")
+    for name, before, after in [
+        ("/devices", devices_before, devices_after),
+        ("/loans", loans_before, loans_after),
+        ("/users/options", users_before, users_after),
+    ]:
+        slow = _measure(f"{name} ORM + response_model", before, page, repeat)
+        fast = _measure(f"{name} lignes + FastJSONResponse", after, page, repeat)
+        print(f"  -> x{slow / fast:.1f}")
+
+
+if __name__ == "__main__":
+    main()
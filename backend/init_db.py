@@ -2,7 +2,7 @@ import os
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 
-from app import models
+from app import cache, models
 from app.database import Base, engine, SessionLocal
 
 BASE_ROLES = ["employee", "gestionnaire", "expert", "admin"]
@@ -139,6 +139,16 @@ def ensure_schema():
                 "ALTER TABLE devices ADD COLUMN IF NOT EXISTS security_level VARCHAR(20) NOT NULL DEFAULT 'standard';"
             )
         )
+        conn.execute(
+            text(
+                "ALTER TABLE devices ADD COLUMN IF NOT EXISTS current_loan_id INTEGER NULL REFERENCES loans(id);"
+            )
+        )
+        conn.execute(
+            text(
+                "ALTER TABLE devices ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;"
+            )
+        )
 
 
 def seed_core(session: Session):
@@ -185,9 +195,16 @@ def seed_core(session: Session):
     session.query(models.Device).filter(models.Device.security_level.is_(None)).update(
         {"security_level": "standard"}, synchronize_session=False
     )
+    _bump_versions(session, models.Role, models.DeviceStatus, models.DeviceType)
     session.commit()
 
 
+def _bump_versions(session: Session, *tables):
+    # Le seed écrit sans passer par crud : invalide les caches et ETags des tables
+    for model in tables:
+        cache.bump_table_version(session, model.__tablename__)
+
+
 def seed_demo(session: Session):
     statuses = {s.name: s for s in session.query(models.DeviceStatus).all()}
     types = {t.name: t for t in session.query(models.DeviceType).all()}
@@ -260,6 +277,7 @@ def seed_demo(session: Session):
         )
         if role_obj and role_obj not in user.roles:
             user.roles.append(role_obj)
+    _bump_versions(session, models.User)
     session.commit()
 
 
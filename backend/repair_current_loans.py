@@ -0,0 +1,25 @@
+"""
+Vérifie que devices.current_loan_id correspond au dernier prêt ouvert de chaque appareil
+et corrige les écarts.
+Usage :
+    poetry run python repair_current_loans.py [--dry-run]
+"""
+
+import sys
+
+from app import crud
+from app.database import SessionLocal
+
+
+def main():
+    dry_run = "--dry-run" in sys.argv[1:]
+    with SessionLocal() as session:
+        drifted = crud.repair_current_loans(session, dry_run=dry_run)
+    for device_id, stored, expected in drifted:
+        print(f"device {device_id}: current_loan_id {stored} -> {expected}")
+    action = "à corriger" if dry_run else "corrigé(s)"
+    print(f"{len(drifted)} appareil(s) {action}.")
+
+
+if __name__ == "__main__":
+    main()
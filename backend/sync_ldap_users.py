@@ -0,0 +1,28 @@
+"""
+Importe les utilisateurs de l'annuaire LDAP (LDAP_SEARCH_BASE / LDAP_SEARCH_FILTER)
+dans la table users, par pages, sans leur attribuer de rôle.
+L'annuaire est lu par tranches (préfixe de l'attribut comparé à {username} dans
+LDAP_SEARCH_FILTER : uid, sAMAccountName...) ; une synchronisation interrompue
+reprend après la dernière tranche terminée.
+Usage :
+    poetry run python sync_ldap_users.py [--restart]
+"""
+
+import sys
+
+from app.config import get_settings
+from app.ldap_sync import sync_users
+
+
+def main():
+    restart = "--restart" in sys.argv[1:]
+    report = sync_users(get_settings(), resume=not restart)
+    print(
+        f"{report['upserted']} utilisateur(s) importé(s) depuis {report['entries']} "
+        f"entrée(s), {report['pages']} page(s), {report['skipped_shards']} tranche(s) "
+        f"déjà importée(s), en {report['duration_seconds']} s."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,25 @@ const api = axios.create({
   baseURL: import.meta.env.VITE_API_URL || "http://localhost:8000",
 });
 
+// Read-after-write: echo the server time of our last write so that the API reads
+// from the primary while the read replica may still lag behind it
+let lastWrite = null;
+
+api.interceptors.response.use((response) => {
+  const writtenAt = response.headers["x-last-write"];
+  if (writtenAt) {
+    lastWrite = writtenAt;
+  }
+  return response;
+});
+
+api.interceptors.request.use((config) => {
+  if (lastWrite) {
+    config.headers["X-Last-Write"] = lastWrite;
+  }
+  return config;
+});
+
 export function setAuthToken(token) {
   if (token) {
     api.defaults.headers.common.Authorization = `Bearer ${token}`;